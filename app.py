@@ -2,15 +2,30 @@
 import eventlet
 eventlet.monkey_patch() 
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, current_app
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, current_app, stream_template, g
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from flask_login import LoginManager
 from config import Config
-from models import db, Admin, User, Assignment, ChatMessage, SystemSettings, LoginAttempt, ChatMessageGifter, ChatMessageGiftee
+from models import db, Admin, User, Assignment, ChatMessage, ChatMessageGifter, ChatMessageGiftee, SystemSettings, LoginAttempt, ChatReadCursor, NotificationJob, PendingChatNotification, MatchExclusion
 from utils.email_service import EmailService
+from utils.email_queue import EmailQueue
+from utils.announcement_job import AnnouncementJob
+from utils.chat_notifications import ChatNotifier
+from utils.chat_store import ChatStore
+from utils.chat_writer import ChatBatchWriter, AssignmentRef
+from utils.socket_sessions import ChatSessionCache, chat_room
+from utils.typing_tracker import TypingTracker
+from utils.chat_search import ChatSearchIndex
+from utils.retention import DataRetention
+from utils.settings_cache import SettingsCache
 from utils.assignment_logic import AssignmentGenerator
-from utils.auth import admin_required, user_required, check_rate_limit, log_login_attempt
-from datetime import datetime
+from utils.migrations import run_migrations
+from utils.csv_export import csv_response
+from utils.socket_bus import socketio_bus_options
+from utils.auth import admin_required, participant_required, check_rate_limit, log_login_attempt
+from utils.participant_context import ParticipantLoader
+from utils.login_limiter import LoginRateLimiter, LoginAuditLog
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 
@@ -18,6 +33,8 @@ from dotenv import load_dotenv
 load_dotenv()
 from keepalive import keep_db_alive
 import threading
+import uuid
+import click
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
 
@@ -37,15 +54,20 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     "max_overflow": 10,
     "pool_size": 5,
 }
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('mssql+pyodbc'):
+    # Send executemany batches (bulk assignment inserts) as one round-trip
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['fast_executemany'] = True
 
 
 # Initialize extensions
 db.init_app(app)
-socketio = SocketIO(app, cors_allowed_origins="*", sync_mode='eventlet')
+socketio = SocketIO(app, cors_allowed_origins="*", sync_mode='eventlet',
+                    **socketio_bus_options(app.config.get('SOCKETIO_MESSAGE_QUEUE')))
 
 # Create database tables
 with app.app_context():
     db.create_all()
+    run_migrations()
 
     # Initialize system settings if not exists
     if not SystemSettings.query.first():
@@ -59,11 +81,25 @@ with app.app_context():
     else:
         app.config['FIRST_RUN'] = False
 threading.Thread(target=keep_db_alive, daemon=True).start()
+LoginRateLimiter.init_app(app)
+LoginAuditLog.start(app)
+EmailQueue.start_workers(app)
+AnnouncementJob.resume_incomplete(app)
+ChatNotifier.start_worker(app)
+ChatSessionCache.init_app(socketio)
+SettingsCache.init_app()
+TypingTracker.start(app, socketio)
+ChatSearchIndex.init_app()
+ChatSearchIndex.start_catch_up(app)
+if app.config.get('CHAT_WRITE_BEHIND'):
+    ChatBatchWriter.start(app, socketio)
+if app.config.get('RETENTION_ENABLED'):
+    DataRetention.start(app)
 
 # ==================== HOME & REGISTRATION ====================
 @app.route('/')
 def index():
-    settings = SystemSettings.query.first()
+    settings = SettingsCache.get()
 
     # Check if first run (no admin)
     if app.config.get('FIRST_RUN', False):
@@ -75,7 +111,7 @@ def index():
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
-    settings = SystemSettings.query.first()
+    settings = SettingsCache.get()
 
     # Check if registration is open
     if settings.phase != 1 or not settings.registration_open:
@@ -88,6 +124,7 @@ def register():
         email = request.form.get('email', '').strip().lower()
         address = request.form.get('address', '').strip()
         preferences = request.form.get('preferences', '').strip()
+        team = request.form.get('team', '').strip() or None
 
         # Validation
         if not all([name, emp_id, email, preferences]):
@@ -119,17 +156,27 @@ def register():
             emp_id=emp_id,
             email=email,
             address=address,
-            preferences=preferences
+            preferences=preferences,
+            team=team
         )
 
         db.session.add(user)
         db.session.commit()
 
-        # Send confirmation email
+        # Late registration: splice into the existing assignments
+        if settings.assignments_generated:
+            try:
+                AssignmentGenerator.add_participant(user.id)
+                db.session.commit()
+            except ValueError as e:
+                db.session.rollback()
+                app.logger.error(f"Could not add {user.emp_id} to existing assignments: {str(e)}")
+
+        # Queue confirmation email (delivered by the outbox workers)
         try:
             EmailService.send_registration_confirmation(user)
         except Exception as e:
-            app.logger.error(f"Failed to send confirmation email: {str(e)}")
+            app.logger.error(f"Failed to queue confirmation email: {str(e)}")
 
         return render_template('register_success.html', user=user)
 
@@ -139,7 +186,7 @@ def register():
 # ==================== USER LOGIN & AUTHENTICATION ====================
 @app.route('/login', methods=['GET', 'POST'])
 def user_login():
-    settings = SystemSettings.query.first()
+    settings = SettingsCache.get()
 
     # Check if Phase 2 is active
     if settings.phase != 2:
@@ -182,77 +229,37 @@ def user_logout():
 
 # ==================== USER DASHBOARD ====================
 @app.route('/dashboard')
-@user_required
+@participant_required
 def user_dashboard():
-    user = User.query.get(session['user_id'])
-
-    # Find assignment where user is either gifter or giftee
-    assignment = Assignment.query.filter(
-        (Assignment.gifter_user_id == user.id) | (Assignment.giftee_user_id == user.id)
-    ).first()
+    participant = g.participant
 
+    # The reveal belongs to the assignment where the user is the gifter
+    assignment = participant.as_gifter
     if not assignment:
         flash('No assignment found. Please contact admin.', 'error')
         return redirect(url_for('index'))
 
-    # Determine the user's role for this assignment
-    is_gifter = (assignment.gifter_user_id == user.id)
-
-    # Provide both objects to the template so it can render both chat cards
-    gifter = assignment.gifter
-    giftee = assignment.giftee
-
-    # Unread counts:
-    # - unread_gifter_chat: unread messages in the "as gifter" view (messages sent by giftee)
-    # - unread_giftee_chat: unread messages in the "as giftee" view (messages sent by gifter)
-    try:
-        unread_gifter_chat = ChatMessageGifter.query.filter_by(
-            assignment_id=assignment.id,
-            sender_type='giftee',
-            read=False
-        ).count()
-    except Exception:
-        # If role-specific tables don't exist (legacy), fallback to ChatMessage
-        unread_gifter_chat = ChatMessage.query.filter_by(
-            assignment_id=assignment.id,
-            sender_type='giftee',
-            read=False
-        ).count()
-
-    try:
-        unread_giftee_chat = ChatMessageGiftee.query.filter_by(
-            assignment_id=assignment.id,
-            sender_type='gifter',
-            read=False
-        ).count()
-    except Exception:
-        unread_giftee_chat = ChatMessage.query.filter_by(
-            assignment_id=assignment.id,
-            sender_type='gifter',
-            read=False
-        ).count()
-
     # If reveal not completed, direct to reveal flow
     if not assignment.reveal_completed:
         return redirect(url_for('reveal'))
 
+    # Both chat cards: the user's giftee, and their own (anonymous) Secret Santa
+    # - unread_gifter_chat: unread messages in the "as gifter" view (messages sent by giftee)
+    # - unread_giftee_chat: unread messages in the "as giftee" view (messages sent by gifter)
     return render_template(
         'user/dashboard.html',
-        user=user,
-        gifter=gifter,
-        giftee=giftee,
+        user=participant.user,
+        giftee=participant.giftee,
         assignment=assignment,
-        is_gifter=is_gifter,
-        unread_gifter_chat=unread_gifter_chat,
-        unread_giftee_chat=unread_giftee_chat,
+        unread_gifter_chat=participant.unread_as_gifter,
+        unread_giftee_chat=participant.unread_as_giftee,
         budget=current_app.config['GIFT_BUDGET']
     )
 # ==================== REVEAL ANIMATION ====================
 @app.route('/reveal')
-@user_required
+@participant_required
 def reveal():
-    user = User.query.get(session['user_id'])
-    assignment = Assignment.query.filter_by(gifter_user_id=user.id).first()
+    assignment = g.participant.as_gifter
 
     if not assignment:
         flash('No assignment found', 'error')
@@ -262,22 +269,24 @@ def reveal():
         return redirect(url_for('user_dashboard'))
 
     # Get giftee name (all cards/segments will show this)
-    giftee_name = assignment.giftee.name
+    giftee_name = g.participant.giftee.name
 
     return render_template('user/reveal.html',
                            giftee_name=giftee_name,
                            animation_type='spin')  # or 'scratch'
 
 @app.route('/api/complete-reveal', methods=['POST'])
-@user_required
+@participant_required
 def complete_reveal():
-    user = User.query.get(session['user_id'])
-    assignment = Assignment.query.filter_by(gifter_user_id=user.id).first()
+    assignment = g.participant.as_gifter
 
-    if assignment and not assignment.reveal_completed:
-        assignment.reveal_completed = True
-        assignment.reveal_time = datetime.utcnow()
+    # Conditional update: only the first reveal counts
+    if assignment and Assignment.query.filter_by(id=assignment.id, reveal_completed=False).update({
+        'reveal_completed': True,
+        'reveal_time': datetime.utcnow()
+    }, synchronize_session=False):
         db.session.commit()
+        ParticipantLoader.invalidate(g.participant.user.id)
 
         return jsonify({'success': True})
 
@@ -286,13 +295,12 @@ def complete_reveal():
 # Continue to Part 2...
 # ==================== CHAT FUNCTIONALITY ====================
 @app.route('/chat')
-@user_required
+@participant_required
 def chat():
-    user = User.query.get(session['user_id'])
-    assignment = Assignment.query.filter(
-        (Assignment.gifter_user_id == user.id) | (Assignment.giftee_user_id == user.id)
-    ).first()
-    settings = SystemSettings.query.first()
+    participant = g.participant
+    user = participant.user
+    assignment = participant.as_gifter or participant.as_giftee
+    settings = SettingsCache.get()
 
     if not assignment or not assignment.reveal_completed:
         flash('Please complete the reveal first', 'error')
@@ -302,27 +310,26 @@ def chat():
         flash('Chat is currently disabled', 'error')
         return redirect(url_for('user_dashboard'))
 
-    # Determine role and pick the right table
     is_gifter = (assignment.gifter_user_id == user.id)
+    role = 'gifter' if is_gifter else 'giftee'
 
-    if is_gifter:
-        messages = ChatMessageGifter.query.filter_by(assignment_id=assignment.id).order_by(ChatMessageGifter.timestamp).all()
-        # Mark messages from giftee as read in gifter table
-        ChatMessageGifter.query.filter_by(assignment_id=assignment.id, sender_type='giftee', read=False).update({'read': True})
-    else:
-        messages = ChatMessageGiftee.query.filter_by(assignment_id=assignment.id).order_by(ChatMessageGiftee.timestamp).all()
-        # Mark messages from gifter as read in giftee table
-        ChatMessageGiftee.query.filter_by(assignment_id=assignment.id, sender_type='gifter', read=False).update({'read': True})
+    # Only the newest page is rendered; chat.js loads older ones on scroll
+    messages, has_more = ChatStore.page(assignment.id, limit=current_app.config['CHAT_PAGE_SIZE'])
+    if messages:
+        ChatStore.mark_read(assignment.id, role, max(m.id for m in messages))
 
+    # Read before the digest window closed: no email needed
+    ChatNotifier.clear(assignment.id, role)
     db.session.commit()
+    ParticipantLoader.invalidate(user.id)
 
-    # Convert role-specific model objects to a common shape for template (use to_dict)
     messages_list = [m.to_dict() for m in messages]
 
     return render_template('user/chat.html',
                            user=user,
                            assignment=assignment,
                            messages=messages_list,
+                           has_more=has_more,
                            is_gifter=is_gifter)
 
 # ==================== ADMIN SETUP (First Run) ====================
@@ -408,13 +415,13 @@ def admin_logout():
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    settings = SystemSettings.query.first()
+    settings = SettingsCache.get()
 
     stats = {
         'total_participants': User.query.count(),
         'assignments_generated': settings.assignments_generated,
         'reveals_completed': Assignment.query.filter_by(reveal_completed=True).count(),
-        'total_messages': ChatMessage.query.count(),
+        'total_messages': ChatStore.total_messages(),
         'phase': settings.phase
     }
 
@@ -425,7 +432,41 @@ def admin_dashboard():
 @admin_required
 def admin_participants():
     participants = User.query.all()
-    return render_template('admin/participants.html', participants=participants)
+    exclusions = MatchExclusion.query.order_by(MatchExclusion.gifter_emp_id, MatchExclusion.giftee_emp_id).all()
+    return render_template('admin/participants.html', participants=participants, exclusions=exclusions)
+
+@app.route('/admin/exclusions', methods=['POST'])
+@admin_required
+def add_exclusion():
+    gifter_emp_id = request.form.get('gifter_emp_id', '').strip()
+    giftee_emp_id = request.form.get('giftee_emp_id', '').strip()
+    both_ways = request.form.get('both_ways') == 'on'
+
+    if not gifter_emp_id or not giftee_emp_id or gifter_emp_id == giftee_emp_id:
+        flash('Enter two different employee IDs', 'error')
+        return redirect(url_for('admin_participants'))
+
+    pairs = [(gifter_emp_id, giftee_emp_id)]
+    if both_ways:
+        pairs.append((giftee_emp_id, gifter_emp_id))
+
+    for gifter, giftee in pairs:
+        if not MatchExclusion.query.filter_by(gifter_emp_id=gifter, giftee_emp_id=giftee).first():
+            db.session.add(MatchExclusion(gifter_emp_id=gifter, giftee_emp_id=giftee))
+    db.session.commit()
+
+    flash('Exclusion rule added. It applies the next time assignments are generated.', 'success')
+    return redirect(url_for('admin_participants'))
+
+@app.route('/admin/exclusions/<int:exclusion_id>/delete', methods=['POST'])
+@admin_required
+def delete_exclusion(exclusion_id):
+    exclusion = MatchExclusion.query.get_or_404(exclusion_id)
+    db.session.delete(exclusion)
+    db.session.commit()
+
+    flash('Exclusion rule removed', 'success')
+    return redirect(url_for('admin_participants'))
 
 @app.route('/admin/participants/<int:user_id>/edit', methods=['GET', 'POST'])
 @admin_required
@@ -437,6 +478,7 @@ def edit_participant(user_id):
         user.email = request.form.get('email', '').strip().lower()
         user.address = request.form.get('address', '').strip()
         user.preferences = request.form.get('preferences', '').strip()
+        user.team = request.form.get('team', '').strip() or None
 
         db.session.commit()
         flash('Participant updated successfully', 'success')
@@ -449,67 +491,70 @@ def edit_participant(user_id):
 def delete_participant(user_id):
     user = User.query.get_or_404(user_id)
 
-    # Delete related assignments and messages
-    Assignment.query.filter(
-        (Assignment.gifter_user_id == user_id) | (Assignment.giftee_user_id == user_id)
-    ).delete()
+    # Splice the participant out of the chain, keeping everyone else's pairs
+    try:
+        changed = AssignmentGenerator.remove_participant(user_id)
+        repaired = True
+    except ValueError as e:
+        db.session.rollback()
+        AssignmentGenerator.drop_participant_assignments(user_id)
+        changed, repaired = [], False
+        flash(f'Could not re-link assignments ({str(e)}). Please regenerate assignments.', 'warning')
 
     db.session.delete(user)
     db.session.commit()
 
+    if repaired and changed:
+        flash(f'{len(changed)} assignment(s) were re-linked around the removed participant', 'info')
     flash('Participant deleted successfully', 'success')
     return redirect(url_for('admin_participants'))
 
 @app.route('/admin/participants/export')
 @admin_required
 def export_participants():
-    import csv
-    from io import StringIO
-    from flask import make_response
+    participants = db.session.query(
+        User.name, User.emp_id, User.email, User.preferences, User.address, User.created_at
+    ).order_by(User.id).yield_per(1000)
 
-    participants = User.query.all()
+    rows = (
+        [p.name, p.emp_id, p.email, p.preferences, p.address, p.created_at.strftime('%Y-%m-%d %H:%M:%S')]
+        for p in participants
+    )
 
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['Name', 'Employee ID', 'Email', 'Preferences', 'Address', 'Registered On'])
-
-    for user in participants:
-        writer.writerow([
-            user.name,
-            user.emp_id,
-            user.email,
-            user.preferences,
-            user.address,
-            user.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        ])
-
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=participants.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    return csv_response(
+        'participants.csv',
+        ['Name', 'Employee ID', 'Email', 'Preferences', 'Address', 'Registered On'],
+        rows,
+        compress=request.args.get('gzip') == '1'
+    )
 
 # ==================== ADMIN ASSIGNMENTS ====================
 @app.route('/admin/assignments')
 @admin_required
 def admin_assignments():
-    settings = SystemSettings.query.first()
-    assignments = AssignmentGenerator.get_assignment_map()
+    settings = SettingsCache.get()
+    after_id = request.args.get('after', type=int)
+    assignments, next_after_id = AssignmentGenerator.get_assignment_page(
+        after_id, limit=app.config.get('ADMIN_PAGE_SIZE', 100))
 
     return render_template('admin/assignments.html',
                            assignments=assignments,
-                           settings=settings)
+                           settings=settings,
+                           after_id=after_id,
+                           next_after_id=next_after_id)
 
 @app.route('/admin/assignments/generate', methods=['POST'])
 @admin_required
 def generate_assignments():
     try:
-        count = AssignmentGenerator.generate_assignments()
+        result = AssignmentGenerator.generate_assignments()
 
         settings = SystemSettings.query.first()
         settings.assignments_generated = True
         db.session.commit()
 
-        flash(f'Successfully generated {count} assignments', 'success')
+        flash(f"Successfully generated {result['count']} assignments "
+              f"(cleared in {result['delete_seconds']:.2f}s, written in {result['insert_seconds']:.2f}s)", 'success')
     except Exception as e:
         flash(f'Error generating assignments: {str(e)}', 'error')
 
@@ -518,50 +563,44 @@ def generate_assignments():
 @app.route('/admin/assignments/export')
 @admin_required
 def export_assignments():
-    import csv
-    from io import StringIO
-    from flask import make_response
-
-    assignments = AssignmentGenerator.get_assignment_map()
-
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['Gifter Name', 'Gifter Email', 'Giftee Name', 'Giftee Email', 'Giftee Preferences', 'Reveal Completed'])
-
-    for assignment in assignments:
-        writer.writerow([
-            assignment['gifter']['name'],
-            assignment['gifter']['email'],
-            assignment['giftee']['name'],
-            assignment['giftee']['email'],
-            assignment['giftee']['preferences'],
-            'Yes' if assignment['reveal_completed'] else 'No'
-        ])
-
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=assignments.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    rows = (
+        [a.gifter_name, a.gifter_email, a.giftee_name, a.giftee_email, a.giftee_preferences,
+         'Yes' if a.reveal_completed else 'No']
+        for a in AssignmentGenerator.iter_assignments()
+    )
+
+    return csv_response(
+        'assignments.csv',
+        ['Gifter Name', 'Gifter Email', 'Giftee Name', 'Giftee Email', 'Giftee Preferences', 'Reveal Completed'],
+        rows,
+        compress=request.args.get('gzip') == '1'
+    )
 
 @app.route('/admin/assignments/<int:assignment_id>/override', methods=['POST'])
 @admin_required
 def override_assignment(assignment_id):
-    new_giftee_id = request.form.get('new_giftee_id', type=int)
+    # The new giftee is typed in as an employee ID or email; both are unique
+    giftee_ref = request.form.get('new_giftee', '').strip()
+    if not giftee_ref:
+        flash('Enter the new giftee\'s employee ID or email', 'error')
+        return redirect(url_for('admin_assignments'))
 
+    new_giftee_id = db.session.query(User.id).filter_by(emp_id=giftee_ref).scalar() \
+        or db.session.query(User.id).filter_by(email=giftee_ref.lower()).scalar()
     if not new_giftee_id:
-        flash('Invalid giftee selection', 'error')
+        flash(f'No participant with employee ID or email "{giftee_ref}"', 'error')
         return redirect(url_for('admin_assignments'))
 
-    assignment = Assignment.query.get_or_404(assignment_id)
+    Assignment.query.get_or_404(assignment_id)
 
-    # Validate no self-assignment
-    if assignment.gifter_user_id == new_giftee_id:
-        flash('Cannot assign a person to themselves', 'error')
+    # Swap giftees with whoever had the new giftee, so everyone still gets exactly one gift
+    try:
+        AssignmentGenerator.reassign(assignment_id, new_giftee_id)
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
         return redirect(url_for('admin_assignments'))
 
-    assignment.giftee_user_id = new_giftee_id
-    assignment.reveal_completed = False
-    assignment.reveal_time = None
     db.session.commit()
 
     flash('Assignment updated successfully', 'success')
@@ -581,18 +620,18 @@ def admin_settings():
             if new_phase in [1, 2]:
                 settings.phase = new_phase
 
-                # If moving to Phase 2, notify all users
-                if new_phase == 2:
-                    users = User.query.all()
-                    for user in users:
-                        try:
-                            login_url = url_for('user_login', _external=True)
-                            EmailService.send_phase2_announcement(user, login_url)
-                        except Exception as e:
-                            app.logger.error(f"Failed to send email to {user.email}: {str(e)}")
+                # If moving to Phase 2, notify all users from a background job
+                job = None
+                if new_phase == 2 and not AnnouncementJob.active_job():
+                    job = AnnouncementJob.create(url_for('user_login', _external=True))
 
                 db.session.commit()
-                flash(f'Phase updated to {new_phase}', 'success')
+
+                if job:
+                    AnnouncementJob.start(app, job.id)
+                    flash(f'Phase updated to {new_phase}. Sending announcements to {job.total} participants in the background.', 'success')
+                else:
+                    flash(f'Phase updated to {new_phase}', 'success')
 
         elif action == 'toggle_registration':
             settings.registration_open = not settings.registration_open
@@ -636,9 +675,17 @@ def admin_settings():
         elif action == 'reset_system':
             # Confirm reset
             if request.form.get('confirm_reset') == 'RESET':
-                # Archive or delete all data
-                Assignment.query.delete()
+                # Keep this year's pairs so next year's draw can avoid repeats
+                AssignmentGenerator.archive_assignments()
+
+                # Delete all data, children before the rows they reference
+                ChatSessionCache.mark_stale(db.session, [row.id for row in db.session.query(Assignment.id)])
+                PendingChatNotification.query.delete()
+                ChatReadCursor.query.delete()
                 ChatMessage.query.delete()
+                ChatMessageGifter.query.delete()
+                ChatMessageGiftee.query.delete()
+                Assignment.query.delete()
                 User.query.delete()
                 LoginAttempt.query.delete()
 
@@ -647,34 +694,44 @@ def admin_settings():
                 settings.registration_open = True
 
                 db.session.commit()
+                ChatSearchIndex.clear()
                 flash('System reset successfully. Ready for next year!', 'success')
             else:
                 flash('Reset cancelled. Type RESET to confirm.', 'warning')
 
         return redirect(url_for('admin_settings'))
 
-    return render_template('admin/settings.html', settings=settings)
+    announcement_job = NotificationJob.query.filter_by(kind=AnnouncementJob.KIND) \
+        .order_by(NotificationJob.id.desc()).first()
+
+    return render_template('admin/settings.html',
+                           settings=settings,
+                           announcement_job=announcement_job)
+
+@app.route('/admin/jobs/<int:job_id>/progress')
+@admin_required
+def notification_job_progress(job_id):
+    job = NotificationJob.query.get_or_404(job_id)
+    return jsonify(AnnouncementJob.progress(job))
 @app.route('/chat/gifter')
-@user_required
+@participant_required
 def chat_as_gifter():
-    user = User.query.get(session['user_id'])
-    assignment = Assignment.query.filter_by(gifter_user_id=user.id).first()
-
-    messages = ChatMessageGifter.query \
-        .filter_by(assignment_id=assignment.id) \
-        .order_by(ChatMessageGifter.timestamp).all()
-
-    # Mark read (messages from giftee)
-    ChatMessageGifter.query.filter_by(
-        assignment_id=assignment.id,
-        sender_type='giftee',
-        read=False
-    ).update({'read': True})
+    assignment = g.participant.as_gifter
+    if not assignment:
+        flash('No assignment found', 'error')
+        return redirect(url_for('user_dashboard'))
+
+    messages, has_more = ChatStore.page(assignment.id, limit=current_app.config['CHAT_PAGE_SIZE'])
+    if messages:
+        ChatStore.mark_read(assignment.id, 'gifter', max(m.id for m in messages))
+    ChatNotifier.clear(assignment.id, 'gifter')
     db.session.commit()
+    ParticipantLoader.invalidate(g.participant.user.id)
 
     return render_template(
         'user/chat.html',
         messages=[m.to_dict() for m in messages],
+        has_more=has_more,
         assignment=assignment,
         is_gifter=True,
         chat_mode='gifter'
@@ -682,60 +739,98 @@ def chat_as_gifter():
 
 
 @app.route('/chat/giftee')
-@user_required
+@participant_required
 def chat_as_giftee():
-    user = User.query.get(session['user_id'])
-    assignment = Assignment.query.filter_by(giftee_user_id=user.id).first()
-
-    messages = ChatMessageGiftee.query \
-        .filter_by(assignment_id=assignment.id) \
-        .order_by(ChatMessageGiftee.timestamp).all()
-
-    # Mark read (messages from gifter)
-    ChatMessageGiftee.query.filter_by(
-        assignment_id=assignment.id,
-        sender_type='gifter',
-        read=False
-    ).update({'read': True})
+    assignment = g.participant.as_giftee
+    if not assignment:
+        flash('No assignment found', 'error')
+        return redirect(url_for('user_dashboard'))
+
+    messages, has_more = ChatStore.page(assignment.id, limit=current_app.config['CHAT_PAGE_SIZE'])
+    if messages:
+        ChatStore.mark_read(assignment.id, 'giftee', max(m.id for m in messages))
+    ChatNotifier.clear(assignment.id, 'giftee')
     db.session.commit()
+    ParticipantLoader.invalidate(g.participant.user.id)
 
     return render_template(
         'user/chat.html',
         messages=[m.to_dict() for m in messages],
+        has_more=has_more,
         assignment=assignment,
         is_gifter=False,
         chat_mode='giftee'
     )
 
+@app.route('/chat/<int:assignment_id>/messages')
+@participant_required
+def chat_history(assignment_id):
+    """Older chat messages as JSON: ?before=<message id>&limit=<n>"""
+    own_chats = {a.id for a in (g.participant.as_gifter, g.participant.as_giftee) if a}
+    if assignment_id not in own_chats:
+        return jsonify({'error': 'Not part of this assignment'}), 403
+
+    page_size = current_app.config['CHAT_PAGE_SIZE']
+    limit = min(request.args.get('limit', page_size, type=int), page_size * 4)
+    messages, has_more = ChatStore.page(assignment_id, request.args.get('before', type=int), max(limit, 1))
+
+    return jsonify({
+        'messages': [m.to_dict() for m in messages],
+        'has_more': has_more
+    })
+
 # ==================== ADMIN CHAT MONITORING ====================
 @app.route('/admin/chats')
 @admin_required
 def admin_chats():
-    settings = SystemSettings.query.first()
+    settings = SettingsCache.get()
     if not settings.admin_can_view_chats:
         flash('Chat monitoring is disabled', 'warning')
         return redirect(url_for('admin_dashboard'))
 
-    assignments = Assignment.query.filter_by(reveal_completed=True).all()
-    chat_data = []
-
-    for assignment in assignments:
-        # get messages from both tables and merge
-        msgs_g = ChatMessageGifter.query.filter_by(assignment_id=assignment.id).all()
-        msgs_q = ChatMessageGiftee.query.filter_by(assignment_id=assignment.id).all()
-        # Prefer whichever has content; they should generally be identical
-        combined = sorted(
-            [m.to_dict() for m in msgs_g] + [m.to_dict() for m in msgs_q],
-            key=lambda x: x['timestamp']
-        )
-        chat_data.append({
-            'assignment': assignment,
-            'gifter': assignment.gifter,
-            'giftee': assignment.giftee,
-            'messages': combined
-        })
+    # One query for the page of chats, one streamed query for their messages;
+    # the page is rendered while the messages are read
+    after_id = request.args.get('after', type=int)
+    rows, next_after_id = ChatStore.admin_page(after_id, current_app.config['ADMIN_CHAT_PAGE_SIZE'])
+
+    return stream_template('admin/chats.html',
+                           has_chats=bool(rows),
+                           chat_data=ChatStore.iter_conversations(rows),
+                           after_id=after_id,
+                           next_after_id=next_after_id)
+
+@app.route('/admin/chats/search')
+@admin_required
+def admin_chat_search():
+    settings = SettingsCache.get()
+    if not settings.admin_can_view_chats:
+        flash('Chat monitoring is disabled', 'warning')
+        return redirect(url_for('admin_dashboard'))
+
+    query = request.args.get('q', '').strip()
+    assignment_id = request.args.get('assignment_id', type=int)
+    date_from = ChatSearchIndex.parse_date(request.args.get('from'))
+    date_to = ChatSearchIndex.parse_date(request.args.get('to'))
 
-    return render_template('admin/chats.html', chat_data=chat_data)
+    results = []
+    if query:
+        if not ChatSearchIndex.enabled():
+            flash('Chat search is not available on this server', 'warning')
+        else:
+            # "to" is inclusive in the form, exclusive in the index
+            message_ids = ChatSearchIndex.search(
+                query, assignment_id, date_from,
+                date_to + timedelta(days=1) if date_to else None,
+                limit=current_app.config['ADMIN_PAGE_SIZE']
+            )
+            results = ChatSearchIndex.load_results(message_ids)
+
+    return render_template('admin/chat_search.html',
+                           query=query,
+                           assignment_id=assignment_id,
+                           date_from=request.args.get('from', ''),
+                           date_to=request.args.get('to', ''),
+                           results=results)
 
 # ==================== SOCKETIO CHAT EVENTS ====================
 from flask import session as flask_session
@@ -749,15 +844,21 @@ def handle_connect():
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    # Nothing special to do here; rooms are left automatically when socket disconnects.
+    # Rooms are left automatically when the socket disconnects
+    ChatSessionCache.drop(request.sid)
+    TypingTracker.stop(request.sid)
     current_app.logger.debug('Socket disconnected')
 
 @socketio.on('join_chat')
 def handle_join_chat(data):
     """
     Client requests to join a chat room for an assignment.
-    Expects: { assignment_id: <int> }
+    Expects: { assignment_id: <int>, last_seen_id: <int, optional> }
+    With last_seen_id, messages the client missed while disconnected are
+    replayed in a single 'missed_messages' event; a last_seen_id that is
+    not a non-negative integer means no replay.
     """
+    joined = False
     try:
         user_id = flask_session.get('user_id')
         if not user_id:
@@ -779,39 +880,70 @@ def handle_join_chat(data):
             emit('join_ack', {'success': False, 'error': 'Not part of this assignment'})
             return
 
-        room = f'chat_{assignment.id}'
+        # Parsed before joining so a bad value can't fail the join after its ack
+        try:
+            last_seen_id = int(data.get('last_seen_id'))
+        except (TypeError, ValueError):
+            last_seen_id = None
+        if last_seen_id is not None and last_seen_id < 0:
+            last_seen_id = None
+
+        room = chat_room(assignment.id)
         join_room(room)
+        ChatSessionCache.bind(request.sid, user_id, assignment,
+                              'gifter' if assignment.gifter_user_id == user_id else 'giftee')
         emit('join_ack', {'success': True, 'room': room})
+        joined = True
         current_app.logger.info(f'User {user_id} joined room {room}')
+
+        # Joined before replaying, so nothing sent in between is lost; the
+        # client drops duplicates by id
+        if last_seen_id is not None:
+            missed, truncated = ChatStore.since(
+                assignment.id, last_seen_id, current_app.config['CHAT_REPLAY_LIMIT']
+            )
+            if missed or truncated:
+                emit('missed_messages', {
+                    'messages': [m.to_dict() for m in missed],
+                    'truncated': truncated
+                })
     except Exception as e:
         current_app.logger.exception('Error in join_chat')
-        emit('join_ack', {'success': False, 'error': str(e)})
+        if joined:
+            # The join itself succeeded and was acked; only the replay failed
+            emit('error_message', {'error': 'Could not load missed messages'})
+        else:
+            emit('join_ack', {'success': False, 'error': str(e)})
 
 @socketio.on('typing')
 def handle_typing(data):
     """
     Typing indicator.
     Expects: { typing: True/False, assignment_id: <id> }
+    Only start/stop transitions are broadcast (see TypingTracker).
     """
     try:
         user_id = flask_session.get('user_id')
         if not user_id:
             return
         assignment_id = data.get('assignment_id')
-        typing = data.get('typing', False)
+        typing = bool(data.get('typing', False))
         if not assignment_id:
             return
-        room = f'chat_{int(assignment_id)}'
-        emit('user_typing', {'typing': typing}, room=room, include_self=False)
+        # Only sockets that joined this chat may signal typing in it
+        if ChatSessionCache.get(request.sid, user_id, int(assignment_id)) is None:
+            return
+        TypingTracker.update(request.sid, chat_room(int(assignment_id)), typing)
     except Exception:
         current_app.logger.exception('Error in typing handler')
 
 @socketio.on('send_message')
 def handle_message(data):
     """
-    Expects: { message: "...", assignment_id: <id> }
-    Stores message into both role-specific chat tables (so each participant views messages
-    under their own 'context' table).
+    Expects: { message: "...", assignment_id: <id>, client_id: <optional> }
+    Appends the message to the assignment's chat log (one insert). With
+    CHAT_WRITE_BEHIND the message is broadcast first (id None, temp_id set)
+    and a 'message_ack' carrying its id follows once its batch is committed.
     """
     try:
         user_id = flask_session.get('user_id')
@@ -827,66 +959,67 @@ def handle_message(data):
             emit('error_message', {'error': 'Missing assignment_id'})
             return
 
-        assignment = Assignment.query.get(int(assignment_id))
-        if not assignment:
-            emit('error_message', {'error': 'Assignment not found'})
-            return
-        if not assignment.reveal_completed:
-            emit('error_message', {'error': 'Reveal not completed yet'})
-            return
-
-        # Determine sender_type
-        if assignment.gifter_user_id == user_id:
-            sender_type = 'gifter'
-        elif assignment.giftee_user_id == user_id:
-            sender_type = 'giftee'
+        # Sockets that joined the room were verified then; no reads needed
+        binding = ChatSessionCache.get(request.sid, user_id, int(assignment_id))
+        if binding is not None and binding.reveal_completed:
+            chat, sender_type = binding.assignment, binding.role
         else:
-            emit('error_message', {'error': 'Not participant of this assignment'})
-            return
+            assignment = Assignment.query.get(int(assignment_id))
+            if not assignment:
+                emit('error_message', {'error': 'Assignment not found'})
+                return
+            if not assignment.reveal_completed:
+                emit('error_message', {'error': 'Reveal not completed yet'})
+                return
+
+            # Determine sender_type
+            if assignment.gifter_user_id == user_id:
+                sender_type = 'gifter'
+            elif assignment.giftee_user_id == user_id:
+                sender_type = 'giftee'
+            else:
+                emit('error_message', {'error': 'Not participant of this assignment'})
+                return
 
-        # Persist to the legacy single table for backward compatibility if desired
-        # (optional) - keep existing table behavior
-        message = ChatMessage(
-            assignment_id=assignment.id,
-            sender_type=sender_type,
-            message_text=message_text
-        )
-        db.session.add(message)
+            if chat_room(assignment.id) in rooms():
+                chat = ChatSessionCache.bind(request.sid, user_id, assignment, sender_type).assignment
+            else:
+                chat = AssignmentRef(assignment.id, assignment.gifter_user_id, assignment.giftee_user_id)
+
+        room = chat_room(chat.id)
+        TypingTracker.stop(request.sid)
+
+        if current_app.config.get('CHAT_WRITE_BEHIND'):
+            temp_id = str(data.get('client_id') or uuid.uuid4().hex)
+            timestamp = datetime.utcnow()
+            emit('new_message', {
+                'id': None,
+                'temp_id': temp_id,
+                'sender_type': sender_type,
+                'message_text': message_text,
+                'timestamp': timestamp.isoformat()
+            }, room=room)
+            ChatBatchWriter.submit(chat, sender_type, message_text, timestamp, temp_id)
+            return
 
-        # Persist to role-specific tables:
-        gm = ChatMessageGifter(
-            assignment_id=assignment.id,
-            sender_type=sender_type,
-            message_text=message_text
-        )
-        qm = ChatMessageGiftee(
-            assignment_id=assignment.id,
-            sender_type=sender_type,
-            message_text=message_text
-        )
-        db.session.add(gm)
-        db.session.add(qm)
+        message = ChatStore.append(chat.id, sender_type, message_text)
 
-        db.session.commit()
+        # Count towards the other party's debounced email digest
+        ChatNotifier.record_message(chat, sender_type)
 
+        # Build the payload before commit expires the row
+        db.session.flush()
+        message_id, timestamp = message.id, message.timestamp
         payload = {
-            'id': message.id,
-            'sender_type': message.sender_type,
-            'message_text': message.message_text,
-            'timestamp': message.timestamp.isoformat()
+            'id': message_id,
+            'sender_type': sender_type,
+            'message_text': message_text,
+            'timestamp': timestamp.isoformat()
         }
-
-        room = f'chat_{assignment.id}'
+        db.session.commit()
         emit('new_message', payload, room=room)
+        ChatSearchIndex.add([(message_id, chat.id, message_text, timestamp)])
 
-        # Send email notification to the other party (best-effort)
-        try:
-            if sender_type == 'gifter':
-                EmailService.send_new_message_notification(assignment.giftee, True)
-            else:
-                EmailService.send_new_message_notification(assignment.gifter, False)
-        except Exception:
-            current_app.logger.exception('Failed to send notification email')
     except Exception:
         current_app.logger.exception('Error in send_message handler')
         emit('error_message', {'error': 'Server error while sending message'})
@@ -896,6 +1029,35 @@ def handle_giftee_message(data):
     # Backwards compatibility: reuse send_message handler
     handle_message(data)
 
+# ==================== MAINTENANCE COMMANDS ====================
+@app.cli.command('rebuild-chat-counters')
+def rebuild_chat_counters():
+    """Recompute unread/received chat counters from the message log."""
+    fixed = ChatStore.rebuild_counters()
+    db.session.commit()
+    print(f"Chat counters rebuilt ({fixed} cursors were missing or wrong)")
+
+
+@app.cli.command('index-chat-messages')
+@click.option('--rebuild', is_flag=True, help='Drop the index and index every message again.')
+def index_chat_messages(rebuild):
+    """Backfill the chat search index from the message log."""
+    if not ChatSearchIndex.enabled():
+        print("Chat search is disabled or SQLite has no FTS5 support")
+        return
+    if rebuild:
+        ChatSearchIndex.clear()
+    print(f"Indexed {ChatSearchIndex.catch_up()} chat messages")
+
+
+@app.cli.command('purge-old-data')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that are past their retention period.')
+def purge_old_data(dry_run):
+    """Delete (and optionally archive) rows older than RETENTION_DAYS."""
+    purged = DataRetention.run(dry_run=dry_run)
+    for table, count in purged.items():
+        print(f"{table}: {count} rows {'due' if dry_run else 'purged'}")
+
 # ==================== ERROR HANDLERS ====================
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,158 @@
+"""
+Chat write throughput: one commit per message vs. write-behind group commits.
+
+    python bench_chat_writes.py --messages 5000 --senders 8 --rtt-ms 5
+
+--rtt-ms adds a simulated network round trip to every statement and commit,
+which is what makes per-message commits expensive against a remote database.
+Runs against a throwaway SQLite file unless --database is given.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import event
+
+from config import Config
+from models import db, User, Assignment
+from utils.chat_notifications import ChatNotifier
+from utils.chat_store import ChatStore
+from utils.chat_writer import ChatBatchWriter, AssignmentRef
+
+
+class AckCounter:
+    """Stands in for socketio; counts acked messages"""
+
+    def __init__(self):
+        self.acked = 0
+        self.done = threading.Event()
+        self.expected = 0
+        self._lock = threading.Lock()
+
+    def emit(self, event_name, payload, room=None):
+        if event_name != 'message_ack':
+            return
+        with self._lock:
+            self.acked += len(payload['messages'])
+            if self.acked >= self.expected:
+                self.done.set()
+
+
+def make_app(database_url, rtt_ms):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['CHAT_SEARCH_ENABLED'] = False
+    if database_url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 60}}
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        if rtt_ms:
+            delay = rtt_ms / 1000.0
+            event.listen(db.engine, 'before_cursor_execute', lambda *args: time.sleep(delay))
+            event.listen(db.engine, 'commit', lambda *args: time.sleep(delay))
+    return app
+
+
+def make_assignments(app, count):
+    """AssignmentRefs, as the socket handler has them from its session cache"""
+    with app.app_context():
+        users = [User(name=f'Bench {i}', emp_id=f'BENCH{i}', email=f'bench{i}@example.com') for i in range(count)]
+        db.session.add_all(users)
+        db.session.flush()
+        assignments = [
+            Assignment(gifter_user_id=users[i].id, giftee_user_id=users[(i + 1) % count].id, reveal_completed=True)
+            for i in range(count)
+        ]
+        db.session.add_all(assignments)
+        db.session.commit()
+        return [AssignmentRef(a.id, a.gifter_user_id, a.giftee_user_id) for a in assignments]
+
+
+def run_senders(senders, messages, send_one):
+    per_sender = messages // senders
+
+    def sender(n):
+        for i in range(per_sender):
+            send_one(n, i)
+
+    threads = [threading.Thread(target=sender, args=(n,)) for n in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return per_sender * senders
+
+
+def bench_per_message(app, assignments, senders, messages):
+    """What handle_message does without write-behind"""
+    def send_one(n, i):
+        chat = assignments[n % len(assignments)]
+        with app.app_context():
+            message = ChatStore.append(chat.id, 'gifter', f'msg {i}')
+            ChatNotifier.record_message(chat, 'gifter')
+            # The handler reads these for its broadcast before committing
+            db.session.flush()
+            message_id, timestamp = message.id, message.timestamp
+            db.session.commit()
+            db.session.remove()
+
+    start = time.perf_counter()
+    sent = run_senders(senders, messages, send_one)
+    return sent, time.perf_counter() - start
+
+
+def bench_write_behind(app, assignments, senders, messages):
+    """Messages are queued and acked when their batch commits"""
+    acks = AckCounter()
+    acks.expected = (messages // senders) * senders
+    ChatBatchWriter.start(app, acks)
+
+    def send_one(n, i):
+        chat = assignments[n % len(assignments)]
+        ChatBatchWriter.submit(chat, 'gifter', f'msg {i}', datetime.utcnow(), f'{n}-{i}')
+
+    start = time.perf_counter()
+    sent = run_senders(senders, messages, send_one)
+    acks.done.wait()
+    return sent, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--senders', type=int, default=8, help='concurrent senders (socket handlers)')
+    parser.add_argument('--chats', type=int, default=50, help='number of assignments to spread messages over')
+    parser.add_argument('--rtt-ms', type=float, default=0, help='simulated database round trip')
+    parser.add_argument('--batch-size', type=int, default=Config.CHAT_WRITE_BATCH_SIZE)
+    parser.add_argument('--batch-ms', type=float, default=Config.CHAT_WRITE_BATCH_MS)
+    parser.add_argument('--database', help='SQLAlchemy URL (default: temporary SQLite file)')
+    args = parser.parse_args()
+
+    database_url = args.database
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+    app = make_app(database_url, args.rtt_ms)
+    app.config['CHAT_WRITE_BATCH_SIZE'] = args.batch_size
+    app.config['CHAT_WRITE_BATCH_MS'] = args.batch_ms
+    assignments = make_assignments(app, max(args.chats, 3))
+
+    print(f"{args.messages} messages, {args.senders} senders, {args.rtt_ms} ms simulated RTT")
+    results = {}
+    for name, bench in (('per-message commit', bench_per_message), ('write-behind', bench_write_behind)):
+        sent, elapsed = bench(app, assignments, args.senders, args.messages)
+        results[name] = sent / elapsed
+        print(f"  {name:20s} {sent:7d} msgs in {elapsed:7.2f}s = {results[name]:9.0f} msgs/s")
+
+    print(f"  speed-up: {results['write-behind'] / results['per-message commit']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -22,8 +22,26 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     
-    # Rate limiting
-    RATELIMIT_STORAGE_URL = 'memory://'
+    # Login rate limiting: failed attempts are counted in memory per worker,
+    # or in Redis (redis://...) to share the count between workers
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+    # login_attempts audit rows are written in background batches
+    LOGIN_AUDIT_BATCH_SIZE = 100
+    LOGIN_AUDIT_FLUSH_SECONDS = 1.0
+    LOGIN_AUDIT_QUEUE_SIZE = 10000  # rows beyond this are dropped during a flood
+    
+    # Data retention: rows older than these many days are purged (0 keeps all)
+    RETENTION_DAYS = {
+        'login_attempts': 90,
+        'chat_messages': 365,
+        'chat_messages_gifter': 30,  # legacy copies, already merged into chat_messages
+        'chat_messages_giftee': 30,
+    }
+    RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'false').lower() == 'true'  # background purge
+    RETENTION_INTERVAL = 6 * 3600  # seconds between background purges
+    RETENTION_CHUNK_SIZE = 4000  # rows per delete; below SQL Server's lock escalation at ~5000
+    RETENTION_CHUNK_PAUSE = 0.2  # seconds between chunks
+    RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR')  # gzipped NDJSON copies before purge
     
     # File upload
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
@@ -31,6 +49,51 @@ class Config:
     # Application settings
     GIFT_BUDGET = 1500
     COMPANY_DOMAIN = None  # Set to restrict emails, e.g., '@company.com'
+    ASSIGNMENT_INSERT_CHUNK_SIZE = 1000  # rows per executemany batch
+    ASSIGNMENT_AVOID_SAME_TEAM = True  # never match two people from the same team
+    ASSIGNMENT_HISTORY_YEARS = 1  # don't repeat pairs from this many past years
+    ADMIN_PAGE_SIZE = 100  # rows per page in admin tables
+    ADMIN_CHAT_PAGE_SIZE = 25  # conversations per page in the chat monitor
+    SETTINGS_MAX_STALENESS = 5  # seconds before a worker notices another worker's settings change
+    PARTICIPANT_CACHE_TTL = float(os.environ.get('PARTICIPANT_CACHE_TTL', 0))  # seconds; 0 loads per request
+    
+    # Email delivery (outbox workers)
+    EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', 2))
+    EMAIL_POLL_INTERVAL = 2  # seconds between polls when the outbox is empty
+    EMAIL_BATCH_SIZE = 10
+    EMAIL_MAX_ATTEMPTS = 5
+    EMAIL_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+    EMAIL_LEASE_SECONDS = 120  # a claimed message is retried if not finished in time
+    
+    # SMTP session pool (sessions are reused across messages)
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 4))
+    SMTP_MAX_MESSAGES_PER_SESSION = int(os.environ.get('SMTP_MAX_MESSAGES_PER_SESSION', 100))
+    SMTP_SESSION_IDLE_TIMEOUT = 60  # seconds before an idle session is reconnected
+    
+    # Chat notification digests: one email per window of unread messages
+    CHAT_NOTIFICATION_WINDOW = int(os.environ.get('CHAT_NOTIFICATION_WINDOW', 300))  # seconds
+    CHAT_NOTIFICATION_POLL_INTERVAL = 15
+    CHAT_PAGE_SIZE = 50  # messages per history page; older ones load on scroll
+    CHAT_REPLAY_LIMIT = 200  # most messages replayed to a reconnecting socket
+    # Write-behind: broadcast chat messages at once and persist them in
+    # group commits of up to CHAT_WRITE_BATCH_SIZE, at most CHAT_WRITE_BATCH_MS apart
+    CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'false').lower() == 'true'
+    CHAT_WRITE_BATCH_SIZE = 200
+    CHAT_WRITE_BATCH_MS = 10
+    TYPING_TTL = 5.0  # seconds without an update before "typing" is cleared
+    TYPING_MIN_INTERVAL = 0.5  # fastest a socket can re-announce typing
+    # Moderation search: local SQLite FTS5 index of chat messages
+    CHAT_SEARCH_ENABLED = os.environ.get('CHAT_SEARCH_ENABLED', 'true').lower() == 'true'
+    CHAT_SEARCH_INDEX_PATH = os.environ.get('CHAT_SEARCH_INDEX_PATH', 'chat_search.db')
+    CHAT_SEARCH_RECONCILE_INTERVAL = 3600  # seconds between index/database reconciles; 0: startup only
+    
+    # Phase 2 announcement fan-out job
+    PHASE2_SEND_RATE = float(os.environ.get('PHASE2_SEND_RATE', 10))  # emails per second
+    PHASE2_SEND_CONCURRENCY = int(os.environ.get('PHASE2_SEND_CONCURRENCY', 4))
+    PHASE2_MAX_ATTEMPTS = 3
     
     # SocketIO
     SOCKETIO_ASYNC_MODE = 'threading'
+    # Shared pub/sub for room broadcasts when running several workers:
+    # redis://..., amqp://... or unix:///path/to/bus.sock (see utils/socket_bus.py)
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
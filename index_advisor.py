@@ -0,0 +1,246 @@
+"""
+Index advisor: replays the app's hot query shapes and compares their plans
+with the indexes the database has now and with every index declared on the
+models.
+
+    python index_advisor.py                       # the configured database
+    python index_advisor.py --database sqlite:///instance/santa.db
+    python index_advisor.py --demo --chats 2000   # throwaway SQLite with sample data
+
+The queries are captured by running the real ChatStore / ParticipantLoader /
+AssignmentGenerator code (writes are rolled back). Plans come from EXPLAIN
+QUERY PLAN on SQLite and SHOWPLAN_XML on SQL Server, which also reports the
+optimizer's estimated cost. Missing indexes are created inside a
+transaction that is rolled back (and dropped again if the driver committed
+the DDL), so the database is left as it was; on SQL Server building them
+still reads and locks each table briefly, so run it off-peak. The
+add_hot_path_indexes migration creates them for real at app startup.
+"""
+import argparse
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event, func, insert, inspect, make_url
+
+from config import Config
+from models import db, User, Assignment, ChatMessage, EmailOutbox, LoginAttempt, PendingChatNotification
+from utils.assignment_logic import AssignmentGenerator
+from utils.chat_store import ChatStore
+from utils.email_queue import EmailQueue
+from utils.migrations import missing_indexes
+from utils.participant_context import ParticipantLoader
+
+
+Sample = namedtuple('Sample', 'user_id email emp_id assignment_id message_id')
+Plan = namedtuple('Plan', 'cost scans detail')
+
+SHOWPLAN_NS = '{http://schemas.microsoft.com/sqlserver/2004/07/showplan}'
+SCAN_OPERATORS = {'Table Scan', 'Clustered Index Scan', 'Index Scan'}
+
+
+# (name, function issuing the query) - the shapes behind the busiest pages
+QUERY_SHAPES = [
+    ('user login', lambda s: User.query.filter_by(email=s.email, emp_id=s.emp_id).first()),
+    ('participant context', lambda s: ParticipantLoader.load(s.user_id)),
+    ('chat history, newest page', lambda s: ChatStore.page(s.assignment_id)),
+    ('chat history, older page', lambda s: ChatStore.page(s.assignment_id, before_id=s.message_id)),
+    ('chat replay on reconnect', lambda s: ChatStore.since(s.assignment_id, 0)),
+    ('mark chat read', lambda s: ChatStore.mark_read(s.assignment_id, 'gifter', s.message_id)),
+    ('admin assignments page', lambda s: AssignmentGenerator.get_assignment_page(limit=100)),
+    ('admin chat monitor', lambda s: list(ChatStore.iter_conversations(ChatStore.admin_page(limit=25)[0]))),
+    ('chat digests due', lambda s: db.session.query(PendingChatNotification.id)
+        .filter(PendingChatNotification.due_at <= datetime.utcnow())
+        .order_by(PendingChatNotification.due_at).limit(100).all()),
+    ('email outbox poll', lambda s: db.session.query(EmailOutbox.id)
+        .filter(EmailQueue._ready_filter(datetime.utcnow()))
+        .order_by(EmailOutbox.id).limit(10).all()),
+    ('login audit by IP', lambda s: LoginAttempt.query.filter(
+        LoginAttempt.ip_address == '10.0.0.1',
+        LoginAttempt.timestamp > datetime.utcnow() - timedelta(minutes=15)).count()),
+]
+
+
+class StatementRecorder:
+    """Collects the SQL (and parameters) the app sends while active"""
+
+    def __init__(self, engine):
+        self.active = False
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and not executemany:
+            self.statements.append((statement, parameters))
+
+    def capture(self, fn, sample):
+        self.statements = []
+        self.active = True
+        try:
+            fn(sample)
+        finally:
+            self.active = False
+            db.session.rollback()
+        return self.statements
+
+
+def make_app(database_url):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['CHAT_SEARCH_ENABLED'] = False
+    db.init_app(app)
+    return app
+
+
+def seed_demo(chats, messages_per_chat):
+    """Tables as they were before the declared indexes, filled with sample data"""
+    db.create_all()
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(conn)
+
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'name': f'Demo {i}', 'emp_id': f'DEMO{i}', 'email': f'demo{i}@example.com'} for i in range(chats)
+    ])
+    user_ids = db.session.scalars(db.select(User.id).order_by(User.id)).all()
+    db.session.execute(insert(Assignment), [
+        {'gifter_user_id': user_ids[i], 'giftee_user_id': user_ids[(i + 1) % chats], 'reveal_completed': i % 10 != 0}
+        for i in range(chats)
+    ])
+    assignment_ids = db.session.scalars(db.select(Assignment.id).order_by(Assignment.id)).all()
+    for start in range(0, chats, 200):
+        db.session.execute(insert(ChatMessage), [
+            {'assignment_id': assignment_id, 'sender_type': 'gifter' if n % 2 else 'giftee',
+             'message_text': f'message {n}', 'timestamp': now - timedelta(minutes=messages_per_chat - n)}
+            for assignment_id in assignment_ids[start:start + 200]
+            for n in range(messages_per_chat)
+        ])
+    db.session.execute(insert(LoginAttempt), [
+        {'ip_address': f'10.0.{i % 250}.{i % 199}', 'email': f'demo{i}@example.com',
+         'success': i % 3 != 0, 'timestamp': now - timedelta(minutes=i)}
+        for i in range(chats * 5)
+    ])
+    db.session.execute(insert(EmailOutbox), [
+        {'to_email': f'demo{i}@example.com', 'subject': 'Demo', 'html_content': '<p>Demo</p>',
+         'status': 'sent' if i % 20 else 'pending', 'next_attempt_at': now}
+        for i in range(chats * 2)
+    ])
+    db.session.commit()
+    ChatStore.rebuild_counters()
+    db.session.commit()
+
+
+def pick_sample():
+    """Real ids to run the queries with, so the plans see real selectivity"""
+    row = db.session.query(ChatMessage.assignment_id, func.max(ChatMessage.id)) \
+        .group_by(ChatMessage.assignment_id).order_by(ChatMessage.assignment_id).first()
+    assignment = db.session.get(Assignment, row[0]) if row else Assignment.query.first()
+    user = db.session.get(User, assignment.gifter_user_id) if assignment else User.query.first()
+    db.session.rollback()
+    return Sample(
+        user_id=user.id if user else 0,
+        email=user.email if user else '',
+        emp_id=user.emp_id if user else '',
+        assignment_id=assignment.id if assignment else 0,
+        message_id=row[1] if row else 0
+    )
+
+
+def explain(conn, statement, parameters):
+    if conn.dialect.name == 'sqlite':
+        details = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        scans = sum(1 for d in details if d.startswith('SCAN ') and 'CONSTANT ROW' not in d)
+        return Plan(None, scans, '; '.join(details))
+
+    if conn.dialect.name == 'mssql':
+        conn.exec_driver_sql('SET SHOWPLAN_XML ON')
+        try:
+            plan_xml = conn.exec_driver_sql(statement, parameters).scalar()
+        finally:
+            conn.exec_driver_sql('SET SHOWPLAN_XML OFF')
+        root = ET.fromstring(plan_xml)
+        cost = sum(float(s.get('StatementSubTreeCost', 0)) for s in root.iter(SHOWPLAN_NS + 'StmtSimple'))
+        operators = []
+        for op in root.iter(SHOWPLAN_NS + 'RelOp'):
+            obj = op.find(f'.//{SHOWPLAN_NS}Object')
+            if obj is not None and op.get('PhysicalOp') in SCAN_OPERATORS | {'Index Seek', 'Clustered Index Seek'}:
+                operators.append(f"{op.get('PhysicalOp')} {obj.get('Table')}.{obj.get('Index')}")
+        scans = sum(1 for op in root.iter(SHOWPLAN_NS + 'RelOp') if op.get('PhysicalOp') in SCAN_OPERATORS)
+        return Plan(cost, scans, '; '.join(operators))
+
+    raise SystemExit(f"No plan support for {conn.dialect.name}")
+
+
+def plans_for(conn, captured):
+    return [[explain(conn, statement, parameters) for statement, parameters in statements]
+            for _, statements in captured]
+
+
+def report(captured, before, after):
+    for (name, statements), plans_before, plans_after in zip(captured, before, after):
+        print(f"\n{name}  ({len(statements)} statement{'s' if len(statements) != 1 else ''})")
+        for b, a in zip(plans_before, plans_after):
+            cost = f"  cost {b.cost:.4f} -> {a.cost:.4f}" if b.cost is not None else ''
+            print(f"  full scans {b.scans} -> {a.scans}{cost}")
+            print(f"    before: {b.detail}")
+            if a.detail != b.detail:
+                print(f"    after:  {a.detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', help='SQLAlchemy URL (default: Config.SQLALCHEMY_DATABASE_URI)')
+    parser.add_argument('--demo', action='store_true', help='use a temporary SQLite database with sample data')
+    parser.add_argument('--chats', type=int, default=1000, help='assignments to create with --demo')
+    parser.add_argument('--messages', type=int, default=20, help='messages per chat with --demo')
+    args = parser.parse_args()
+
+    database_url = args.database or Config.SQLALCHEMY_DATABASE_URI
+    if args.demo:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'advisor.db')
+
+    app = make_app(database_url)
+    with app.app_context():
+        if args.demo:
+            seed_demo(max(args.chats, 3), args.messages)
+
+        recorder = StatementRecorder(db.engine)
+        sample = pick_sample()
+        captured = [(name, recorder.capture(fn, sample)) for name, fn in QUERY_SHAPES]
+        db.session.remove()
+
+        with db.engine.connect() as conn:
+            trans = conn.begin()
+            created = []
+            try:
+                before = plans_for(conn, captured)
+                for index in missing_indexes(conn):
+                    index.create(conn)
+                    created.append(index)
+                after = plans_for(conn, captured)
+            finally:
+                trans.rollback()
+
+            # SQLite's driver runs DDL outside the transaction; undo whatever survived
+            for index in created:
+                if index.name in {i['name'] for i in inspect(conn).get_indexes(index.table.name)}:
+                    index.drop(conn)
+            if conn.in_transaction():
+                conn.commit()
+
+    print(f"Database: {make_url(database_url).render_as_string(hide_password=True)}")
+    if created:
+        print("Missing indexes (tried inside a rolled-back transaction): " + ', '.join(i.name for i in created))
+    else:
+        print("Every declared index already exists; plans below are the current ones.")
+    report(captured, before, after)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,7 @@ class SystemSettings(db.Model):
     registration_open = db.Column(db.Boolean, default=True)
     chat_enabled = db.Column(db.Boolean, default=True)
     admin_can_view_chats = db.Column(db.Boolean, default=False)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # bumped on every change
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -65,6 +66,7 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     address = db.Column(db.Text)
     preferences = db.Column(db.Text)
+    team = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     
@@ -87,7 +89,33 @@ class Assignment(db.Model):
     messages = db.relationship('ChatMessage', backref='assignment', lazy=True, cascade='all, delete-orphan')
     
     __table_args__ = (
-        db.UniqueConstraint('gifter_user_id', 'giftee_user_id', name='unique_assignment'),
+        db.UniqueConstraint('gifter_user_id', 'giftee_user_id', name='unique_assignment'),  # also serves gifter lookups
+        db.Index('ix_assignments_giftee', 'giftee_user_id'),
+        db.Index('ix_assignments_revealed', 'reveal_completed', 'id'),  # chat monitor pages
+    )
+
+
+class AssignmentHistory(db.Model):
+    __tablename__ = 'assignment_history'
+    
+    # Keyed by employee ID: participants re-register (new user ids) every year
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    gifter_emp_id = db.Column(db.String(50), nullable=False)
+    giftee_emp_id = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MatchExclusion(db.Model):
+    __tablename__ = 'match_exclusions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    gifter_emp_id = db.Column(db.String(50), nullable=False)
+    giftee_emp_id = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('gifter_emp_id', 'giftee_emp_id', name='unique_match_exclusion'),
     )
 
 
@@ -101,6 +129,11 @@ class ChatMessage(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     read = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        db.Index('ix_chat_messages_assignment_timestamp', 'assignment_id', 'timestamp', 'id'),  # history pages
+        db.Index('ix_chat_messages_assignment_sender', 'assignment_id', 'sender_type', 'id'),  # unread counts
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -111,6 +144,101 @@ class ChatMessage(db.Model):
         }
 
 
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_content = db.Column(db.Text, nullable=False)
+    text_content = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+
+class PendingChatNotification(db.Model):
+    __tablename__ = 'pending_chat_notifications'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignments.id'), nullable=False)
+    recipient_role = db.Column(db.String(20), nullable=False)  # 'gifter' or 'giftee'
+    recipient_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    message_count = db.Column(db.Integer, default=1, nullable=False)
+    first_message_at = db.Column(db.DateTime, default=datetime.utcnow)
+    due_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('assignment_id', 'recipient_role', name='unique_pending_notification'),
+        db.Index('ix_pending_chat_notifications_due', 'due_at'),
+    )
+
+
+class NotificationJob(db.Model):
+    __tablename__ = 'notification_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # e.g. 'phase2_announcement'
+    status = db.Column(db.String(20), default='running', nullable=False)  # running, completed
+    login_url = db.Column(db.String(500))
+    total = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    recipients = db.relationship('NotificationJobRecipient', backref='job', lazy='dynamic', cascade='all, delete-orphan')
+
+
+class NotificationJobRecipient(db.Model):
+    __tablename__ = 'notification_job_recipients'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('notification_jobs.id'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)  # no FK: participants may be deleted mid-job
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed, skipped
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('job_id', 'user_id', name='unique_job_recipient'),
+    )
+
+
+class ChatReadCursor(db.Model):
+    __tablename__ = 'chat_read_cursors'
+    
+    # Highest chat_messages.id the participant in `role` has seen in this chat,
+    # plus counters of messages received from the other party (kept up to
+    # date on send and read; `flask rebuild-chat-counters` recomputes them)
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignments.id'), nullable=False)
+    role = db.Column(db.String(20), nullable=False)  # 'gifter' or 'giftee'
+    last_read_message_id = db.Column(db.Integer, default=0, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    received_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('assignment_id', 'role', name='unique_chat_read_cursor'),
+    )
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class LoginAttempt(db.Model):
     __tablename__ = 'login_attempts'
     
@@ -119,6 +247,12 @@ class LoginAttempt(db.Model):
     email = db.Column(db.String(120))
     success = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_login_attempts_ip_timestamp', 'ip_address', 'timestamp'),
+    )
+
+
 class ChatMessageGifter(db.Model):
     __tablename__ = 'chat_messages_gifter'
     id = db.Column(db.Integer, primary_key=True)
@@ -11,10 +11,25 @@ document.addEventListener('DOMContentLoaded', function() {
     let connected = false;
     let joinedRoom = null;
 
-    // Utility: add a message to chat UI
-    function addMessageToChat(data, { optimistic = false } = {}) {
-        if (!chatMessages) return;
+    // Highest message id on the page; sent with join_chat so a reconnect
+    // only replays what was missed
+    let lastSeenId = 0;
+    if (chatMessages) {
+        chatMessages.querySelectorAll('.message[data-id]').forEach(el => {
+            lastSeenId = Math.max(lastSeenId, parseInt(el.dataset.id, 10) || 0);
+        });
+    }
+
+    // Typing state of this client (see the input handler below)
+    let typingTimeout;
+    let typingSentAt = 0;
 
+    function hasMessage(id) {
+        return !!(id && chatMessages && chatMessages.querySelector(`.message[data-id="${id}"]`));
+    }
+
+    // Utility: build the DOM node for one message
+    function buildMessageElement(data) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${data.sender_type === 'gifter' ? 'message-sent' : 'message-received'}`;
 
@@ -34,6 +49,22 @@ document.addEventListener('DOMContentLoaded', function() {
 
         contentDiv.appendChild(textP);
         contentDiv.appendChild(timeSpan);
+        messageDiv.appendChild(contentDiv);
+        if (data.id) {
+            messageDiv.dataset.id = data.id;
+        } else if (data.temp_id) {
+            // Write-behind: shown faded until the server acks it as stored
+            messageDiv.dataset.tempId = data.temp_id;
+            messageDiv.style.opacity = '0.6';
+        }
+        return messageDiv;
+    }
+
+    // Utility: add a message to chat UI
+    function addMessageToChat(data, { optimistic = false } = {}) {
+        if (!chatMessages) return;
+
+        const messageDiv = buildMessageElement(data);
 
         // If optimistic, add a subtle opacity and remove when actual server message arrives
         if (optimistic) {
@@ -41,10 +72,49 @@ document.addEventListener('DOMContentLoaded', function() {
             messageDiv.dataset.optimistic = 'true';
         }
 
-        messageDiv.appendChild(contentDiv);
         chatMessages.appendChild(messageDiv);
     }
 
+    // History: only the newest page is rendered; older pages load when the
+    // user scrolls to the top.
+    let hasMoreHistory = !!chatMessages && chatMessages.dataset.hasMore === 'true';
+    let loadingHistory = false;
+
+    function oldestMessageId() {
+        const first = chatMessages && chatMessages.querySelector('.message[data-id]');
+        return first ? first.dataset.id : null;
+    }
+
+    function loadOlderMessages() {
+        if (!hasMoreHistory || loadingHistory || typeof historyUrl === 'undefined') return;
+        const before = oldestMessageId();
+        if (!before) return;
+
+        loadingHistory = true;
+        fetch(`${historyUrl}?before=${encodeURIComponent(before)}`, { credentials: 'same-origin' })
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .then(data => {
+                // Keep the viewport anchored on the message the user was looking at
+                const previousHeight = chatMessages.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                (data.messages || []).forEach(message => fragment.appendChild(buildMessageElement(message)));
+                chatMessages.insertBefore(fragment, chatMessages.firstChild);
+                chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+                hasMoreHistory = !!data.has_more;
+            })
+            .catch(err => console.error('[chat] failed to load older messages', err))
+            .finally(() => { loadingHistory = false; });
+    }
+
+    if (chatMessages) {
+        chatMessages.addEventListener('scroll', function() {
+            if (chatMessages.scrollTop < 80) loadOlderMessages();
+        });
+    }
+
     // Format timestamp nicely
     function formatTime(timestamp) {
         const date = new Date(timestamp);
@@ -87,7 +157,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Try to join the assignment room explicitly.
         // assignmentId should be injected by the template where chat page is rendered.
         if (typeof assignmentId !== 'undefined' && assignmentId) {
-            socket.emit('join_chat', { assignment_id: assignmentId });
+            socket.emit('join_chat', { assignment_id: assignmentId, last_seen_id: lastSeenId });
         } else {
             console.warn('assignmentId is not defined on the page');
         }
@@ -112,6 +182,12 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // The assignment changed (override, removal, new draw): verify again
+    socket.on('rejoin_required', function() {
+        joinedRoom = null;
+        socket.emit('join_chat', { assignment_id: assignmentId, last_seen_id: lastSeenId });
+    });
+
     socket.on('error_message', function(data) {
         console.error('[socket] error_message', data);
         // Optionally show a flash notification in UI
@@ -120,8 +196,29 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Messages broadcast while this socket was disconnected
+    socket.on('missed_messages', function(data) {
+        if (!data) return;
+        if (data.truncated) {
+            // Too far behind for a delta; the page reload fetches the latest page
+            window.location.reload();
+            return;
+        }
+        (data.messages || []).forEach(message => {
+            if (hasMessage(message.id)) return;
+            addMessageToChat(message);
+            lastSeenId = Math.max(lastSeenId, message.id);
+        });
+        if (data.messages && data.messages.length) {
+            scrollToBottom();
+            playNotificationSound();
+        }
+    });
+
     // Server sent new message (broadcast to room)
     socket.on('new_message', function(data) {
+        if (!data || hasMessage(data.id)) return;
+
         // If an optimistic message exists at the bottom, remove it when we get confirmed server message
         // Simple heuristic: if last message is optimistic and text equals new message, remove optimistic
         try {
@@ -136,11 +233,34 @@ document.addEventListener('DOMContentLoaded', function() {
             // ignore matching errors
         }
 
+        hideTypingIndicator();
         addMessageToChat(data);
+        lastSeenId = Math.max(lastSeenId, data.id || 0);
         scrollToBottom();
         playNotificationSound();
     });
 
+    // Write-behind mode: a batch of messages has been committed
+    socket.on('message_ack', function(data) {
+        (data && data.messages || []).forEach(ack => {
+            const el = chatMessages && chatMessages.querySelector(`.message[data-temp-id="${ack.temp_id}"]`);
+            if (el) {
+                el.dataset.id = ack.id;
+                delete el.dataset.tempId;
+                el.style.opacity = '';
+            }
+            lastSeenId = Math.max(lastSeenId, ack.id);
+        });
+    });
+
+    socket.on('message_failed', function(data) {
+        const el = data && chatMessages && chatMessages.querySelector(`.message[data-temp-id="${data.temp_id}"]`);
+        if (el) {
+            el.classList.add('message-failed');
+            showNotification('A message could not be saved', 'error');
+        }
+    });
+
     // Typing indicator events from server (optional)
     socket.on('user_typing', function(data) {
         if (!data) return;
@@ -170,8 +290,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
             scrollToBottom();
 
-            // Emit to server with assignment_id
+            // Emit to server with assignment_id; sending also ends "typing" server-side
             socket.emit('send_message', { message: message, assignment_id: assignmentId });
+            clearTimeout(typingTimeout);
+            typingSentAt = 0;
 
             // Clear input
             messageInput.value = '';
@@ -188,14 +310,19 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
 
-        // Typing indicator: emit typing start/stop
-        let typingTimeout;
+        // Typing indicator: emit only start/stop, plus a refresh every few
+        // seconds of continuous typing so the server-side expiry doesn't fire
         messageInput.addEventListener('input', function() {
             if (!connected) return;
-            socket.emit('typing', { typing: true, assignment_id: assignmentId });
+            const now = Date.now();
+            if (!typingSentAt || now - typingSentAt > 3000) {
+                socket.emit('typing', { typing: true, assignment_id: assignmentId });
+                typingSentAt = now;
+            }
             clearTimeout(typingTimeout);
             typingTimeout = setTimeout(() => {
                 socket.emit('typing', { typing: false, assignment_id: assignmentId });
+                typingSentAt = 0;
             }, 900);
         });
     }
@@ -236,6 +363,10 @@ document.addEventListener('DOMContentLoaded', function() {
         console.log('[notification]', type, msg);
     }
 
-    // Initial scroll to bottom
-    setTimeout(scrollToBottom, 100);
+    // Initial scroll to bottom; if the first page doesn't fill the box there
+    // is nothing to scroll, so fetch the next one straight away
+    setTimeout(function() {
+        scrollToBottom();
+        if (chatMessages && chatMessages.scrollHeight <= chatMessages.clientHeight) loadOlderMessages();
+    }, 100);
 });
@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from utils.assignment_constraints import AssignmentInfeasibleError, ConstraintEngine
+
+
+def random_start(ids, rng):
+    shuffled = ids[:]
+    rng.shuffle(shuffled)
+    return dict(zip(ids, shuffled))
+
+
+def assert_valid(engine, ids, giftee_of):
+    assert sorted(giftee_of) == sorted(ids)
+    assert sorted(giftee_of.values()) == sorted(ids)
+    for gifter, giftee in giftee_of.items():
+        assert engine.allowed(gifter, giftee), (gifter, giftee)
+        assert giftee_of[giftee] != gifter, f"{gifter} and {giftee} give to each other"
+
+
+def only_allowed(ids, allowed):
+    """Exclusions that leave each gifter exactly the giftees in `allowed`"""
+    everyone = set(ids)
+    return {gifter: everyone - targets for gifter, targets in allowed.items()}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_two_options_each(seed):
+    # A hidden valid cycle plus one random extra option per person
+    rng = random.Random(seed)
+    ids = list(range(200))
+    order = ids[:]
+    rng.shuffle(order)
+    allowed = {order[i]: {order[(i + 1) % len(ids)], rng.choice(ids)} - {order[i]} for i in range(len(ids))}
+    engine = ConstraintEngine(ids, excluded=only_allowed(ids, allowed), rng=rng)
+
+    assert_valid(engine, ids, engine.solve(random_start(ids, rng)))
+
+
+def test_teams_and_random_exclusions():
+    rng = random.Random(1)
+    ids = list(range(2000))
+    teams = {i: f'team-{i % 20}' for i in ids}
+    excluded = {i: set(rng.sample(ids, 300)) for i in ids}
+    engine = ConstraintEngine(ids, teams=teams, excluded=excluded, rng=rng)
+
+    assert_valid(engine, ids, engine.solve(random_start(ids, rng)))
+
+
+def test_without_start():
+    rng = random.Random(2)
+    ids = list(range(50))
+    engine = ConstraintEngine(ids, teams={i: i % 3 for i in ids}, rng=rng)
+
+    assert_valid(engine, ids, engine.solve())
+
+
+@pytest.mark.parametrize('n', [9, 10, 11])
+def test_agrees_with_exhaustive_search_when_feasible(n):
+    rng = random.Random(n)
+    ids = list(range(n))
+    checked = 0
+    while checked < 100:
+        excluded = {g: set(rng.sample(ids, rng.randint(0, n - 3))) for g in ids}
+        engine = ConstraintEngine(ids, excluded=excluded, rng=rng)
+        if engine._search() is None:
+            continue
+        assert_valid(engine, ids, engine.solve(random_start(ids, rng)))
+        checked += 1
+
+
+def test_hall_violation_is_reported():
+    # Three people who may only give to the same two; every count-based check passes
+    ids = list(range(20))
+    allowed = {g: set(ids) - {g} for g in ids}
+    for g in (0, 1, 2):
+        allowed[g] = {10, 11}
+    engine = ConstraintEngine(ids, excluded=only_allowed(ids, allowed), labels={0: 'Ann', 1: 'Bob', 2: 'Cy'})
+    assert engine.feasibility_report() == []
+
+    with pytest.raises(AssignmentInfeasibleError) as raised:
+        engine.solve()
+    assert raised.value.report == [
+        "these 3 participants can only give to 2 people between them: Ann, Bob, Cy",
+        "the only people they may give to: 10, 11",
+    ]
+
+
+def test_forced_pair_is_reported():
+    # 3 and 4 may only give to each other
+    ids = list(range(20))
+    allowed = {g: set(ids) - {g} for g in ids}
+    allowed[3], allowed[4] = {4}, {3}
+    engine = ConstraintEngine(ids, excluded=only_allowed(ids, allowed), rng=random.Random(0))
+    assert engine.feasibility_report() == []
+
+    with pytest.raises(AssignmentInfeasibleError) as raised:
+        engine.solve()
+    assert "would have to give to each other" in raised.value.report[0]
+    assert {'3', '4'} <= set(raised.value.report[0].replace(':', ' ').split())
+
+
+def test_team_majority_is_reported():
+    ids = list(range(20))
+    engine = ConstraintEngine(ids, teams={i: 'ops' if i < 11 else 'dev' for i in ids})
+
+    with pytest.raises(AssignmentInfeasibleError) as raised:
+        engine.solve()
+    assert "Team 'ops' has 11 of 20 participants" in str(raised.value)
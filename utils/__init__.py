@@ -1,11 +1,18 @@
 # utils/__init__.py
 from .email_service import EmailService
+from .email_queue import EmailQueue
+from .chat_store import ChatStore
 from .assignment_logic import AssignmentGenerator
+from .assignment_constraints import ConstraintEngine, AssignmentInfeasibleError
 from .auth import admin_required, user_required, check_rate_limit, log_login_attempt
 
 __all__ = [
     'EmailService',
+    'EmailQueue',
+    'ChatStore',
     'AssignmentGenerator',
+    'ConstraintEngine',
+    'AssignmentInfeasibleError',
     'admin_required',
     'user_required',
     'check_rate_limit',
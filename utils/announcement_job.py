@@ -0,0 +1,245 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, insert, literal, select
+from models import db, User, NotificationJob, NotificationJobRecipient
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` happen per second across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class AnnouncementJob:
+    """
+    Background fan-out of the Phase 2 announcement.
+
+    Every recipient gets a row in notification_job_recipients, so progress is
+    visible while the job runs and an interrupted job resumes where it stopped.
+    """
+
+    KIND = 'phase2_announcement'
+    LEASE_SECONDS = 120
+
+    _running = set()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def create(login_url):
+        """Add a job and one pending row per participant; caller commits"""
+        job = NotificationJob(kind=AnnouncementJob.KIND, login_url=login_url)
+        db.session.add(job)
+        db.session.flush()
+
+        db.session.execute(
+            insert(NotificationJobRecipient).from_select(
+                ['job_id', 'user_id', 'status', 'attempts'],
+                select(literal(job.id), User.id, literal('pending'), literal(0))
+            )
+        )
+        job.total = db.session.query(func.count(NotificationJobRecipient.id)).filter_by(job_id=job.id).scalar()
+        return job
+
+    @staticmethod
+    def active_job():
+        return NotificationJob.query.filter_by(kind=AnnouncementJob.KIND, status='running') \
+            .order_by(NotificationJob.id.desc()).first()
+
+    @staticmethod
+    def progress(job):
+        counts = dict(
+            db.session.query(NotificationJobRecipient.status, func.count(NotificationJobRecipient.id))
+            .filter_by(job_id=job.id)
+            .group_by(NotificationJobRecipient.status)
+            .all()
+        )
+        return {
+            'id': job.id,
+            'status': job.status,
+            'total': job.total,
+            'pending': counts.get('pending', 0) + counts.get('sending', 0),
+            'sent': counts.get('sent', 0),
+            'failed': counts.get('failed', 0),
+            'skipped': counts.get('skipped', 0),
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    @staticmethod
+    def start(app, job_id):
+        """Run a job in a background thread (no-op if already running here)"""
+        with AnnouncementJob._lock:
+            if job_id in AnnouncementJob._running:
+                return
+            AnnouncementJob._running.add(job_id)
+
+        threading.Thread(
+            target=AnnouncementJob._run,
+            args=(app, job_id),
+            name=f'announcement-job-{job_id}',
+            daemon=True
+        ).start()
+
+    @staticmethod
+    def resume_incomplete(app):
+        """Restart jobs left running by a previous process"""
+        with app.app_context():
+            try:
+                job_ids = [job.id for job in NotificationJob.query.filter_by(status='running').all()]
+            finally:
+                db.session.remove()
+
+        for job_id in job_ids:
+            app.logger.info(f"Resuming announcement job {job_id}")
+            AnnouncementJob.start(app, job_id)
+
+    @staticmethod
+    def _run(app, job_id):
+        try:
+            limiter = RateLimiter(app.config.get('PHASE2_SEND_RATE', 10))
+            workers = [
+                threading.Thread(target=AnnouncementJob._worker, args=(app, job_id, limiter), daemon=True)
+                for _ in range(app.config.get('PHASE2_SEND_CONCURRENCY', 4))
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+            with app.app_context():
+                try:
+                    AnnouncementJob._finish(job_id)
+                finally:
+                    db.session.remove()
+        except Exception:
+            app.logger.exception(f"Announcement job {job_id} crashed")
+        finally:
+            with AnnouncementJob._lock:
+                AnnouncementJob._running.discard(job_id)
+
+    @staticmethod
+    def _worker(app, job_id, limiter):
+        while True:
+            with app.app_context():
+                try:
+                    recipient_id = AnnouncementJob._claim_next(job_id)
+                    if recipient_id is None:
+                        return
+                    limiter.wait()
+                    AnnouncementJob._deliver(recipient_id)
+                except Exception:
+                    app.logger.exception(f"Announcement job {job_id} worker error")
+                    db.session.rollback()
+                    time.sleep(1)
+                finally:
+                    db.session.remove()
+
+    @staticmethod
+    def _claimable(job_id, now):
+        # Pending rows that are not deferred by a retry backoff, plus rows whose
+        # sender died without finishing (expired lease).
+        return (
+            (NotificationJobRecipient.job_id == job_id) &
+            (
+                ((NotificationJobRecipient.status == 'pending') &
+                 ((NotificationJobRecipient.locked_until == None) | (NotificationJobRecipient.locked_until <= now))) |
+                ((NotificationJobRecipient.status == 'sending') & (NotificationJobRecipient.locked_until < now))
+            )
+        )
+
+    @staticmethod
+    def _claim_next(job_id):
+        """Claim one recipient for this worker; None when nothing is left"""
+        while True:
+            now = datetime.utcnow()
+            row = db.session.query(NotificationJobRecipient.id) \
+                .filter(AnnouncementJob._claimable(job_id, now)) \
+                .order_by(NotificationJobRecipient.id) \
+                .first()
+
+            if row is None:
+                deferred = NotificationJobRecipient.query.filter(
+                    NotificationJobRecipient.job_id == job_id,
+                    NotificationJobRecipient.status.in_(['pending', 'sending'])
+                ).count()
+                if not deferred:
+                    return None
+                # Remaining rows are waiting for a retry or owned by another worker
+                db.session.rollback()
+                time.sleep(1)
+                continue
+
+            claimed = NotificationJobRecipient.query.filter(
+                NotificationJobRecipient.id == row.id,
+                AnnouncementJob._claimable(job_id, now)
+            ).update({
+                'status': 'sending',
+                'locked_until': now + timedelta(seconds=AnnouncementJob.LEASE_SECONDS),
+                'attempts': NotificationJobRecipient.attempts + 1
+            }, synchronize_session=False)
+            db.session.commit()
+
+            if claimed == 1:
+                return row.id
+
+    @staticmethod
+    def _deliver(recipient_id):
+        from .email_service import EmailService
+
+        recipient = db.session.get(NotificationJobRecipient, recipient_id)
+        user = db.session.get(User, recipient.user_id)
+
+        if user is None:
+            recipient.status = 'skipped'
+            recipient.locked_until = None
+            recipient.last_error = 'Participant no longer exists'
+            db.session.commit()
+            return
+
+        subject, html_content, text_content = EmailService.phase2_announcement_content(user, recipient.job.login_url)
+        success = EmailService.send_email(user.email, subject, html_content, text_content)
+
+        now = datetime.utcnow()
+        if success:
+            recipient.status = 'sent'
+            recipient.sent_at = now
+            recipient.locked_until = None
+            recipient.last_error = None
+        elif recipient.attempts >= current_app.config.get('PHASE2_MAX_ATTEMPTS', 3):
+            recipient.status = 'failed'
+            recipient.locked_until = None
+            recipient.last_error = 'Delivery failed (see application log)'
+        else:
+            recipient.status = 'pending'
+            recipient.locked_until = now + timedelta(seconds=30 * recipient.attempts)
+            recipient.last_error = 'Delivery failed, will retry'
+        db.session.commit()
+
+    @staticmethod
+    def _finish(job_id):
+        job = db.session.get(NotificationJob, job_id)
+        remaining = NotificationJobRecipient.query.filter(
+            NotificationJobRecipient.job_id == job_id,
+            NotificationJobRecipient.status.in_(['pending', 'sending'])
+        ).count()
+
+        if job and job.status == 'running' and not remaining:
+            job.status = 'completed'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            current_app.logger.info(f"Announcement job {job_id} completed")
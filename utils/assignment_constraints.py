@@ -0,0 +1,377 @@
+import random
+from collections import Counter, defaultdict, deque
+from itertools import chain
+
+
+class AssignmentInfeasibleError(ValueError):
+    """No assignment satisfies the exclusion rules; `report` says why."""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+    def __str__(self):
+        if not self.report:
+            return self.args[0]
+        return f"{self.args[0]}: " + '; '.join(self.report)
+
+
+class ConstraintEngine:
+    """
+    Finds a gifter -> giftee permutation (no self-assignment, no 2-cycles) that
+    also respects exclusion rules: same-team pairs, pairs from previous years
+    and explicit do-not-match pairs.
+
+    Small groups are searched exhaustively. Larger ones are built as a
+    perfect matching in the bipartite graph of allowed (gifter, giftee)
+    pairs, which is a cycle cover:
+
+    1. Seed the matching with the allowed pairs of a random permutation, then
+       give each remaining gifter a random free giftee where allowed. This
+       keeps results random and leaves k gifters unplaced, k small unless
+       the rules are tight.
+    2. Place each of them along an augmenting path found by BFS. A search is
+       O(V + E) when gifters have few options and O(V + excluded pairs) on
+       dense rules, where it scans the not-yet-visited giftees with set
+       differences instead of listing every gifter's targets. O(k * (V + E))
+       in total. If a search fails, the gifters it visited are a Hall
+       violator: k people who can only give to k - 1 others between them.
+       That is the report, and it is exact.
+    3. Remove 2-cycles. A swap with a gifter in another cycle merges the pair
+       into it (O(deg) per pair). If no swap exists, one side is rematched
+       along an alternating path that avoids the pair's edge (one BFS). If
+       neither edge can be avoided, every cycle cover contains the pair,
+       which is the report.
+
+    Step 3 is a heuristic in one respect: a rematch can create a new pair
+    elsewhere, so after n rematches it stops and says it gave up, naming
+    the pair, rather than claiming the rules are impossible.
+    """
+
+    SAMPLE_TRIES = 64
+    EXHAUSTIVE_LIMIT = 8  # groups this small are searched exhaustively
+    REPORT_NAMES = 10  # participants named per line of an infeasibility report
+
+    def __init__(self, ids, teams=None, excluded=None, labels=None, rng=None):
+        self.ids = list(ids)
+        self.labels = labels or {}
+        self.id_set = set(self.ids)
+        self.teams = {i: t for i, t in (teams or {}).items() if t is not None and t != ''}
+        self.excluded = {}
+        for gifter, giftees in (excluded or {}).items():
+            if gifter in self.id_set:
+                giftees = giftees if isinstance(giftees, (set, frozenset)) else set(giftees)
+                # A subset test is much cheaper than building the intersection
+                self.excluded[gifter] = giftees if giftees <= self.id_set else giftees & self.id_set
+        self.rng = rng or random
+        self._team_members = defaultdict(set)
+        for i, team in self.teams.items():
+            self._team_members[team].add(i)
+        self._adjacency = {}
+
+    def label(self, participant):
+        return self.labels.get(participant, participant)
+
+    def _names(self, participants):
+        names = sorted(str(self.label(p)) for p in participants)
+        if len(names) > self.REPORT_NAMES:
+            return ', '.join(names[:self.REPORT_NAMES]) + f" and {len(names) - self.REPORT_NAMES} more"
+        return ', '.join(names)
+
+    def allowed(self, gifter, giftee):
+        if gifter == giftee:
+            return False
+        team = self.teams.get(gifter)
+        if team is not None and team == self.teams.get(giftee):
+            return False
+        return giftee not in self.excluded.get(gifter, ())
+
+    def _blocked_counts(self):
+        """Number of people each participant cannot give to / receive from"""
+        team_sizes = Counter(self.teams.values())
+        members = self._team_members
+
+        blocked_in = Counter()
+        for i in self.ids:
+            team = self.teams.get(i)
+            blocked_in[i] += team_sizes[team] - 1 if team is not None else 0
+
+        blocked_out = {}
+        for gifter in self.ids:
+            team = self.teams.get(gifter)
+            same_team = team_sizes[team] - 1 if team is not None else 0
+            extra = self.excluded.get(gifter, set())
+            if team is not None:
+                extra = extra - members[team]  # already counted as same-team
+            # Set arithmetic and Counter.update run in C, which matters with
+            # thousands of exclusions per person
+            blocked_in.update(extra)
+            if gifter in extra:
+                blocked_in[gifter] -= 1
+            blocked_out[gifter] = same_team + len(extra) - (gifter in extra)
+
+        return blocked_out, blocked_in
+
+    def feasibility_report(self):
+        """Necessary conditions that are violated; empty if none are obviously broken"""
+        n = len(self.ids)
+        if n < 3:
+            return ["Need at least 3 participants for Secret Santa"]
+
+        report = []
+        for team, size in Counter(self.teams.values()).items():
+            if size > n - size:
+                report.append(
+                    f"Team '{team}' has {size} of {n} participants; "
+                    f"at most half can be from one team when same-team matches are excluded"
+                )
+
+        blocked_out, blocked_in = self._blocked_counts()
+        for i in self.ids:
+            if blocked_out[i] >= n - 1:
+                report.append(f"{self.label(i)} is excluded from giving to everyone")
+            if blocked_in[i] >= n - 1:
+                report.append(f"{self.label(i)} is excluded from receiving from everyone")
+
+        return report
+
+    def solve(self, start=None):
+        """
+        Find an assignment where every pair is allowed. `start` (e.g. a random
+        derangement) seeds the matching so results stay random. Raises
+        AssignmentInfeasibleError with the reason if there is none.
+        """
+        if len(self.ids) <= self.EXHAUSTIVE_LIMIT:
+            report = self.feasibility_report()
+            if report:
+                raise AssignmentInfeasibleError("Exclusion rules cannot be satisfied", report)
+            giftee_of = self._search()
+            if giftee_of is None:
+                raise AssignmentInfeasibleError(
+                    "Exclusion rules cannot be satisfied",
+                    [f"none of the possible assignments of these {len(self.ids)} participants is allowed"]
+                )
+            return giftee_of
+
+        self._adjacency = {}
+        try:
+            giftee_of, gifter_of = self._seed(start or {})
+            for root in [g for g in self.ids if g not in giftee_of]:
+                end, reached_by, group = self._alternating_search(root, giftee_of, gifter_of)
+                if end is None:
+                    # The simple reasons read better; counting them costs as much
+                    # as the matching on dense rules, so only when it failed
+                    raise AssignmentInfeasibleError(
+                        "Exclusion rules cannot be satisfied",
+                        self.feasibility_report() or self._hall_report(group, reached_by)
+                    )
+                self._flip(root, end, reached_by, giftee_of, gifter_of)
+            self._break_pairs(giftee_of, gifter_of)
+            return giftee_of
+        finally:
+            self._adjacency = {}
+
+    def _targets(self, gifter):
+        """Everyone `gifter` may give to, in random order; listed once per solve"""
+        targets = self._adjacency.get(gifter)
+        if targets is None:
+            # Same result as filtering with allowed(), as C-level set differences
+            blocked = self._team_members.get(self.teams.get(gifter), set()) | {gifter}
+            targets = sorted(self.id_set.difference(blocked, self.excluded.get(gifter, ())))
+            self.rng.shuffle(targets)
+            self._adjacency[gifter] = targets
+        return targets
+
+    def _sparse(self, gifter):
+        """True if `gifter` may give to so few people that listing them beats set scans"""
+        team = self.teams.get(gifter)
+        blocked = len(self.excluded.get(gifter, ())) + (len(self._team_members[team]) if team is not None else 0)
+        return (len(self.ids) - blocked) * 8 < len(self.ids)
+
+    def _reach(self, gifter, unvisited, skip):
+        """Remove and return the giftees in `unvisited` that `gifter` may give to"""
+        if self._sparse(gifter):
+            found = {t for t in self._targets(gifter) if t in unvisited}
+        else:
+            # Dense rules: one C-level set difference over what is left to visit,
+            # so a search costs O(n + excluded pairs) instead of O(n^2)
+            team = self.teams.get(gifter)
+            found = unvisited.difference(self.excluded.get(gifter, ()),
+                                         self._team_members[team] if team is not None else ())
+            found.discard(gifter)
+        found.difference_update(skip)
+        unvisited.difference_update(found)
+        return found
+
+    def _search(self):
+        """
+        Backtracking over all permutations, most constrained gifter first.
+        Returns a valid assignment or None if there is none.
+        """
+        blocked_out, _ = self._blocked_counts()
+        order = sorted(self.ids, key=lambda g: blocked_out[g], reverse=True)
+        options = {}
+        for gifter in self.ids:
+            options[gifter] = [t for t in self.ids if self.allowed(gifter, t)]
+            self.rng.shuffle(options[gifter])
+
+        giftee_of = {}
+        taken = set()
+
+        def place(k):
+            if k == len(order):
+                return True
+            gifter = order[k]
+            for target in options[gifter]:
+                if target in taken or giftee_of.get(target) == gifter:
+                    continue
+                giftee_of[gifter] = target
+                taken.add(target)
+                if place(k + 1):
+                    return True
+                del giftee_of[gifter]
+                taken.discard(target)
+            return False
+
+        return giftee_of if place(0) else None
+
+    def _seed(self, start):
+        """A random partial matching with no 2-cycles: allowed pairs of `start`, then greedy picks"""
+        giftee_of, gifter_of = {}, {}
+        for gifter, giftee in start.items():
+            if self.allowed(gifter, giftee) and gifter not in giftee_of and giftee not in gifter_of \
+                    and giftee_of.get(giftee) != gifter:
+                giftee_of[gifter] = giftee
+                gifter_of[giftee] = gifter
+
+        free = [t for t in self.ids if t not in gifter_of]
+        position = {t: i for i, t in enumerate(free)}
+        gifters = [g for g in self.ids if g not in giftee_of]
+        self.rng.shuffle(gifters)
+        for gifter in gifters:
+            for _ in range(min(self.SAMPLE_TRIES, len(free))):
+                target = free[self.rng.randrange(len(free))]
+                if self.allowed(gifter, target) and giftee_of.get(target) != gifter:
+                    giftee_of[gifter] = target
+                    gifter_of[target] = gifter
+                    # O(1) removal: move the last free giftee into its slot
+                    last = free.pop()
+                    if last != target:
+                        free[position[target]] = last
+                        position[last] = position[target]
+                    break
+        return giftee_of, gifter_of
+
+    def _alternating_search(self, root, giftee_of, gifter_of, goal=None, clean=False):
+        """
+        Breadth-first search over alternating paths from gifter `root`: root
+        takes some giftee, that giftee's gifter takes another, and so on until
+        a giftee nobody holds (or `goal`) is reached. With `goal`, root's edge
+        to it is not used. With clean=True, no step lands on someone who gives
+        to the stepping gifter. Returns (end giftee or None, reached_by,
+        gifters visited).
+        """
+        unvisited = set(self.id_set)
+        reached_by = {}  # giftee -> gifter that reached it
+        seen = {root}
+        queue = deque([root])
+        while queue:
+            gifter = queue.popleft()
+            skip = set()
+            if gifter == root and goal is not None:
+                skip.add(goal)
+            if clean and gifter in gifter_of:
+                skip.add(gifter_of[gifter])
+            for target in self._reach(gifter, unvisited, skip):
+                reached_by[target] = gifter
+                holder = None if target == goal else gifter_of.get(target)
+                if holder is None:
+                    return target, reached_by, seen
+                if holder not in seen:
+                    seen.add(holder)
+                    queue.append(holder)
+        return None, reached_by, seen
+
+    @staticmethod
+    def _flip(root, end, reached_by, giftee_of, gifter_of):
+        """Move everyone on the path from `root` to `end` one giftee along; returns the gifters moved"""
+        moved = []
+        target = end
+        while True:
+            gifter = reached_by[target]
+            previous = giftee_of.get(gifter)
+            giftee_of[gifter] = target
+            gifter_of[target] = gifter
+            moved.append(gifter)
+            if gifter == root:
+                return moved
+            target = previous
+
+    def _hall_report(self, group, reached_by):
+        """
+        A failed search from an unmatched gifter visits k gifters who can
+        only give to the k - 1 giftees they hold between them.
+        """
+        return [
+            f"these {len(group)} participants can only give to {len(reached_by)} people between them: "
+            f"{self._names(group)}",
+            f"the only people they may give to: {self._names(reached_by)}"
+        ]
+
+    def _break_pairs(self, giftee_of, gifter_of):
+        """Fold every 2-cycle of a perfect matching into a longer cycle"""
+        pending = deque(g for g in self.ids if giftee_of[giftee_of[g]] == g)
+        rematches = 0
+        while pending:
+            a = pending.popleft()
+            b = giftee_of[a]
+            if giftee_of[b] != a:
+                continue
+            if self._merge_pair(a, b, giftee_of, gifter_of) or self._merge_pair(b, a, giftee_of, gifter_of):
+                continue
+
+            # Prefer paths that create no new pairs; the unrestricted search
+            # then decides whether a -> b and b -> a can be avoided at all
+            moved = None
+            for clean in (True, False):
+                for root, goal in ((a, b), (b, a)):
+                    end, reached_by, _ = self._alternating_search(root, giftee_of, gifter_of, goal, clean)
+                    if end is not None:
+                        moved = self._flip(root, end, reached_by, giftee_of, gifter_of)
+                        break
+                if moved:
+                    break
+            if moved is None:
+                raise AssignmentInfeasibleError(
+                    "Exclusion rules cannot be satisfied",
+                    [f"{self.label(a)} and {self.label(b)} would have to give to each other: "
+                     f"no assignment that gives everyone exactly one allowed giftee avoids it"]
+                )
+
+            rematches += 1
+            if rematches > len(self.ids):
+                raise AssignmentInfeasibleError(
+                    "Could not find assignments that satisfy the exclusion rules",
+                    [f"after {rematches} rematches {self.label(a)} and {self.label(b)} still give to each "
+                     f"other; the rules leave very few options, so relax some of them"]
+                )
+            pending.extend(g for g in moved if giftee_of[giftee_of[g]] == g)
+
+    def _merge_pair(self, a, b, giftee_of, gifter_of):
+        """
+        Swap giftees between a (in the pair a <-> b) and a gifter `other` in
+        another cycle: a -> t ... other -> b -> a, one cycle of length >= 4.
+        """
+        if self._sparse(a):
+            candidates = self._targets(a)
+        else:
+            candidates = chain((self.rng.choice(self.ids) for _ in range(self.SAMPLE_TRIES)), self.ids)
+        for target in candidates:
+            if target == b or not self.allowed(a, target):
+                continue
+            other = gifter_of[target]
+            if self.allowed(other, b):
+                giftee_of[a], giftee_of[other] = target, b
+                gifter_of[target], gifter_of[b] = a, other
+                return True
+        return False
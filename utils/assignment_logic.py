@@ -1,100 +1,522 @@
 # utils/assignment_logic.py
 import random
-from models import User, Assignment, db
+import time
+from datetime import datetime
+from flask import current_app
+from collections import defaultdict
+from sqlalchemy import insert, literal, select
+from sqlalchemy.orm import aliased
+from models import (User, Assignment, AssignmentHistory, MatchExclusion, ChatMessage,
+                    ChatMessageGifter, ChatMessageGiftee, ChatReadCursor, PendingChatNotification, db)
+from .assignment_constraints import ConstraintEngine
+from .chat_search import ChatSearchIndex
+from .socket_sessions import ChatSessionCache
 
 class AssignmentGenerator:
     @staticmethod
-    def generate_assignments():
+    def generate_assignments(chunk_size=None):
         """
         Generate Secret Santa assignments ensuring:
         1. No self-assignment
         2. No cycles of 2 (A->B, B->A)
         3. Each person is both a gifter and giftee exactly once
+
+        Existing assignments are replaced in a single transaction; new rows are
+        written with chunked executemany inserts. Returns the number of
+        assignments and the time spent deleting and inserting.
         """
-        users = User.query.all()
+        chunk_size = chunk_size or current_app.config.get('ASSIGNMENT_INSERT_CHUNK_SIZE', 1000)
+        engine = AssignmentGenerator.build_constraint_engine()
+        ids = engine.ids
         
-        if len(users) < 3:
+        if len(ids) < 3:
             raise ValueError("Need at least 3 participants for Secret Santa")
         
-        # Clear existing assignments
-        Assignment.query.delete()
-        
-        # Create a derangement (permutation where no element appears in its original position)
-        assignments = AssignmentGenerator._create_derangement([u.id for u in users])
-        
-        # Create assignment records
-        for gifter_id, giftee_id in assignments.items():
-            assignment = Assignment(
-                gifter_user_id=gifter_id,
-                giftee_user_id=giftee_id
-            )
-            db.session.add(assignment)
+        # A random permutation with no self-assignment and no 2-cycles seeds
+        # a matching that respects team, history and exclusion rules
+        assignments = engine.solve(AssignmentGenerator._create_derangement(ids))
+
+        problems = AssignmentGenerator.validate_assignments(assignments, ids)
+        if problems:
+            raise ValueError(f"Generated assignments are invalid: {'; '.join(problems[:5])}")
         
-        db.session.commit()
-        return len(assignments)
+        try:
+            # Clear existing assignments; connected chats must rejoin
+            started = time.perf_counter()
+            ChatSessionCache.mark_stale(db.session, [row.id for row in db.session.query(Assignment.id)])
+            Assignment.query.delete(synchronize_session=False)
+            delete_seconds = time.perf_counter() - started
+
+            # Create assignment records
+            started = time.perf_counter()
+            now = datetime.utcnow()
+            rows = [
+                {
+                    'gifter_user_id': gifter_id,
+                    'giftee_user_id': giftee_id,
+                    'reveal_completed': False,
+                    'created_at': now
+                }
+                for gifter_id, giftee_id in assignments.items()
+            ]
+            for i in range(0, len(rows), chunk_size):
+                db.session.execute(insert(Assignment), rows[i:i + chunk_size])
+
+            db.session.commit()
+            insert_seconds = time.perf_counter() - started
+        except Exception:
+            db.session.rollback()
+            raise
+
+        current_app.logger.info(
+            f"Generated {len(rows)} assignments (delete {delete_seconds:.2f}s, insert {insert_seconds:.2f}s)"
+        )
+        return {
+            'count': len(rows),
+            'delete_seconds': delete_seconds,
+            'insert_seconds': insert_seconds
+        }
     
     @staticmethod
-    def _create_derangement(ids):
+    def build_constraint_engine(user_ids=None):
         """
-        Create a derangement - a permutation where no element maps to itself
-        and avoid immediate cycles (A->B, B->A)
+        Load participants and their exclusion rules into a ConstraintEngine.
+        With `user_ids`, only those participants (and rules between them) are
+        loaded, which is enough to check a handful of candidate pairs.
         """
-        max_attempts = 1000
-        
-        for _ in range(max_attempts):
-            shuffled = ids.copy()
-            random.shuffle(shuffled)
-            
-            # Check if valid derangement
-            valid = True
-            assignments = {}
-            
-            for i, original_id in enumerate(ids):
-                new_id = shuffled[i]
-                
-                # No self-assignment
-                if original_id == new_id:
-                    valid = False
-                    break
-                
-                # No immediate cycles
-                if new_id in assignments and assignments[new_id] == original_id:
-                    valid = False
-                    break
-                
-                assignments[original_id] = new_id
-            
-            if valid:
-                return assignments
-        
-        # Fallback: simple rotation (guaranteed to work)
-        return {ids[i]: ids[(i + 1) % len(ids)] for i in range(len(ids))}
-    
+        users = db.session.query(User.id, User.emp_id, User.team)
+        if user_ids is not None:
+            users = users.filter(User.id.in_(list(user_ids)))
+        users = users.all()
+        id_by_emp = {u.emp_id: u.id for u in users}
+        teams = {u.id: u.team for u in users} if current_app.config.get('ASSIGNMENT_AVOID_SAME_TEAM', True) else {}
+
+        excluded = defaultdict(set)
+        exclusions = db.session.query(MatchExclusion.gifter_emp_id, MatchExclusion.giftee_emp_id)
+        if user_ids is not None:
+            exclusions = exclusions.filter(MatchExclusion.gifter_emp_id.in_(list(id_by_emp)))
+        for gifter_emp_id, giftee_emp_id in exclusions:
+            if gifter_emp_id in id_by_emp and giftee_emp_id in id_by_emp:
+                excluded[id_by_emp[gifter_emp_id]].add(id_by_emp[giftee_emp_id])
+
+        history_years = current_app.config.get('ASSIGNMENT_HISTORY_YEARS', 1)
+        if history_years:
+            since = datetime.utcnow().year - history_years
+            past_pairs = db.session.query(AssignmentHistory.gifter_emp_id, AssignmentHistory.giftee_emp_id) \
+                .filter(AssignmentHistory.year >= since)
+            if user_ids is not None:
+                past_pairs = past_pairs.filter(AssignmentHistory.gifter_emp_id.in_(list(id_by_emp)))
+            for gifter_emp_id, giftee_emp_id in past_pairs:
+                if gifter_emp_id in id_by_emp and giftee_emp_id in id_by_emp:
+                    excluded[id_by_emp[gifter_emp_id]].add(id_by_emp[giftee_emp_id])
+
+        labels = {u.id: f"Employee {u.emp_id}" for u in users}
+        return ConstraintEngine([u.id for u in users], teams=teams, excluded=excluded, labels=labels)
+
     @staticmethod
-    def get_assignment_map():
-        """Get all assignments for admin view"""
-        assignments = Assignment.query.all()
-        result = []
-        
-        for assignment in assignments:
-            result.append({
-                'id': assignment.id,
-                'gifter': {
-                    'id': assignment.gifter.id,
-                    'name': assignment.gifter.name,
-                    'emp_id': assignment.gifter.emp_id,
-                    'email': assignment.gifter.email
-                },
-                'giftee': {
-                    'id': assignment.giftee.id,
-                    'name': assignment.giftee.name,
-                    'emp_id': assignment.giftee.emp_id,
-                    'email': assignment.giftee.email,
-                    'preferences': assignment.giftee.preferences,
-                    'address': assignment.giftee.address
-                },
-                'reveal_completed': assignment.reveal_completed,
-                'reveal_time': assignment.reveal_time.isoformat() if assignment.reveal_time else None
-            })
-        
+    def archive_assignments(year=None):
+        """Copy current pairs into assignment_history (by employee ID); caller commits"""
+        year = year or datetime.utcnow().year
+        gifter = aliased(User)
+        giftee = aliased(User)
+        db.session.execute(
+            insert(AssignmentHistory).from_select(
+                ['year', 'gifter_emp_id', 'giftee_emp_id', 'created_at'],
+                select(literal(year), gifter.emp_id, giftee.emp_id, literal(datetime.utcnow()))
+                .select_from(Assignment)
+                .join(gifter, Assignment.gifter_user_id == gifter.id)
+                .join(giftee, Assignment.giftee_user_id == giftee.id)
+            )
+        )
+
+    @staticmethod
+    def _create_derangement(ids, rng=None):
+        """
+        Uniformly random permutation of `ids` whose cycles all have length >= 3,
+        i.e. no self-assignment and no immediate cycles (A->B, B->A), in O(n).
+
+        If a(m) counts such permutations of m people, then
+            a(m) = (m-1)*a(m-1) + (m-1)*(m-2)*a(m-3)
+        The first term slots the last person into an existing cycle right after
+        one of the other m-1 people; the second closes them into a new 3-cycle
+        with an ordered pair of the others. Choosing each branch with probability
+        proportional to its share of a(m) and recursing on the rest makes every
+        valid permutation equally likely. Insertions are recorded top-down and
+        applied bottom-up, once the cycles they slot into exist.
+        """
+        rng = rng or random
+        n = len(ids)
+        if n < 3:
+            raise ValueError("Need at least 3 participants for Secret Santa")
+
+        insert_probability = AssignmentGenerator._insertion_probabilities(n)
+        remaining = list(ids)
+        insertions = []
+        assignments = {}
+
+        while remaining:
+            m = len(remaining)
+            person = remaining.pop()
+
+            if rng.random() < insert_probability[m]:
+                insertions.append((person, remaining[rng.randrange(m - 1)]))
+            else:
+                first = AssignmentGenerator._take_random(remaining, rng)
+                second = AssignmentGenerator._take_random(remaining, rng)
+                assignments[person] = first
+                assignments[first] = second
+                assignments[second] = person
+
+        for person, predecessor in reversed(insertions):
+            assignments[person] = assignments[predecessor]
+            assignments[predecessor] = person
+
+        return assignments
+
+    @staticmethod
+    def _take_random(items, rng):
+        """Remove and return a random element in O(1) (order is not kept)"""
+        index = rng.randrange(len(items))
+        items[index], items[-1] = items[-1], items[index]
+        return items.pop()
+
+    @staticmethod
+    def _insertion_probabilities(n):
+        """
+        p[m] = (m-1)*a(m-1) / a(m): chance that person m joins an existing cycle.
+
+        a(m) overflows floats quickly, so this works with q(k) = a(k)/a(k-1):
+            p[m] = 1 / (1 + (m-2) / (q(m-1) * q(m-2)))
+            q(k) = (k-1) + (k-1)*(k-2) / (q(k-1) * q(k-2))
+        starting from a(3)=2, a(4)=6, a(5)=24.
+        """
+        p = [0.0] * (n + 1)
+        q = [0.0] * (n + 1)
+        for m in range(4, n + 1):
+            if m <= 5:
+                q[m] = m - 1      # a(4)/a(3) = 3, a(5)/a(4) = 4
+                p[m] = 1.0        # a(1) = a(2) = 0: no 3-cycle can leave 1 or 2 people
+            else:
+                p[m] = 1.0 / (1.0 + (m - 2) / (q[m - 1] * q[m - 2]))
+                q[m] = (m - 1) + (m - 1) * (m - 2) / (q[m - 1] * q[m - 2])
+        return p
+
+    @staticmethod
+    def validate_assignments(assignments, ids=None):
+        """
+        Check assignment invariants in O(n). Returns a list of problems, empty
+        when everyone gives exactly once, receives exactly once, never to
+        themselves and never to their own gifter.
+        """
+        problems = []
+        gifters = set(assignments)
+        giftees = set(assignments.values())
+
+        if len(giftees) != len(assignments):
+            problems.append("Some participants receive more than one gift")
+        if gifters != giftees:
+            problems.append("Gifters and giftees are not the same set of people")
+        if ids is not None and gifters != set(ids):
+            problems.append("Assignments do not cover exactly the registered participants")
+
+        for gifter, giftee in assignments.items():
+            if gifter == giftee:
+                problems.append(f"Participant {gifter} is assigned to themselves")
+            elif assignments.get(giftee) == gifter:
+                problems.append(f"Participants {gifter} and {giftee} are assigned to each other")
+
+        return problems
+
+    # ---- Incremental repair -------------------------------------------------
+    # These splice single participants in or out of the existing permutation,
+    # touching O(1) rows. Every other pair keeps its reveal and chat history.
+    # They flush but don't commit; on ValueError the caller rolls back.
+
+    @staticmethod
+    def add_participant(user_id, rng=None):
+        """
+        Splice a new participant into an existing chain: a->b becomes
+        a->new->b. Prefers a pair whose reveal is still pending so no completed
+        reveal is lost. Returns the ids of the changed assignments.
+        """
+        rng = rng or random
+        if Assignment.query.filter_by(gifter_user_id=user_id).first():
+            raise ValueError("Participant already has an assignment")
+
+        for revealed in (False, True):
+            candidates = Assignment.query.filter_by(reveal_completed=revealed).order_by(Assignment.id)
+            count = candidates.count()
+            for _ in range(min(count, 10)):
+                edge = candidates.offset(rng.randrange(count)).first()
+                rules = AssignmentGenerator.build_constraint_engine([edge.gifter_user_id, user_id, edge.giftee_user_id])
+                if rules.allowed(edge.gifter_user_id, user_id) and rules.allowed(user_id, edge.giftee_user_id):
+                    return AssignmentGenerator._splice_in(edge, user_id)
+
+        # Random probes missed (tight rules): scan every pair once with all rules loaded
+        rules = AssignmentGenerator.build_constraint_engine()
+        for edge in Assignment.query.order_by(Assignment.reveal_completed, Assignment.id).yield_per(1000):
+            if rules.allowed(edge.gifter_user_id, user_id) and rules.allowed(user_id, edge.giftee_user_id):
+                return AssignmentGenerator._splice_in(edge, user_id)
+
+        raise ValueError("Could not find a place for the new participant that satisfies the exclusion rules")
+
+    @staticmethod
+    def _splice_in(edge, user_id):
+        new_edge = Assignment(gifter_user_id=user_id, giftee_user_id=edge.giftee_user_id)
+        db.session.add(new_edge)
+        AssignmentGenerator._repoint(edge, user_id)
+        db.session.flush()
+
+        AssignmentGenerator._check_local([edge.gifter_user_id, user_id, new_edge.giftee_user_id])
+        return [edge.id, new_edge.id]
+
+    @staticmethod
+    def remove_participant(user_id, rng=None):
+        """
+        Splice a participant out: a->x->b becomes a->b. If that would leave
+        a and b gifting each other (x was in a 3-person loop), the loop is
+        merged with another chain c->d as a->d and c->b. Returns the ids of the
+        changed assignments.
+        """
+        rng = rng or random
+        outgoing = Assignment.query.filter_by(gifter_user_id=user_id).first()
+        incoming = Assignment.query.filter_by(giftee_user_id=user_id).first()
+        if not outgoing and not incoming:
+            return []
+        if not outgoing or not incoming:
+            raise ValueError("Participant's assignments are already inconsistent; regenerate assignments")
+
+        a, b = incoming.gifter_user_id, outgoing.giftee_user_id
+        touched = {a, b}
+        changed = [incoming.id]
+        AssignmentGenerator._delete_assignments([outgoing.id])
+
+        # a->b is out if b already gifts a (a 2-cycle) or the rules forbid it
+        needs_merge = (
+            Assignment.query.filter_by(gifter_user_id=b, giftee_user_id=a).first() is not None or
+            not AssignmentGenerator.build_constraint_engine([a, b]).allowed(a, b)
+        )
+        if needs_merge:
+            other = AssignmentGenerator._find_merge_partner(incoming, a, b, rng)
+            touched.update([other.gifter_user_id, other.giftee_user_id])
+            AssignmentGenerator._repoint(incoming, other.giftee_user_id)
+            AssignmentGenerator._repoint(other, b)
+            changed.append(other.id)
+        else:
+            AssignmentGenerator._repoint(incoming, b)
+
+        db.session.flush()
+        AssignmentGenerator._check_local(touched)
+        return changed
+
+    @staticmethod
+    def drop_participant_assignments(user_id):
+        """Delete a participant's pairs without re-linking (leaves the chain broken)"""
+        assignment_ids = [row.id for row in db.session.query(Assignment.id).filter(
+            (Assignment.gifter_user_id == user_id) | (Assignment.giftee_user_id == user_id)
+        )]
+        if assignment_ids:
+            AssignmentGenerator._delete_assignments(assignment_ids)
+
+    @staticmethod
+    def _find_merge_partner(incoming, a, b, rng):
+        """Another pair c->d such that a->d and c->b are both allowed"""
+        candidates = Assignment.query.filter(
+            Assignment.id != incoming.id,
+            Assignment.gifter_user_id.notin_([a, b]),
+            Assignment.giftee_user_id.notin_([a, b])
+        ).order_by(Assignment.reveal_completed, Assignment.id)
+        count = candidates.count()
+        if not count:
+            raise ValueError("Not enough participants left to keep a valid Secret Santa chain")
+
+        # a->d must not face d->a, and c->b must not face b->c
+        a_gifter = db.session.query(Assignment.gifter_user_id).filter(
+            Assignment.giftee_user_id == a, Assignment.id != incoming.id).scalar()
+        b_giftee = db.session.query(Assignment.giftee_user_id).filter_by(gifter_user_id=b).scalar()
+
+        for _ in range(min(count, 20)):
+            other = candidates.offset(rng.randrange(count)).first()
+            c, d = other.gifter_user_id, other.giftee_user_id
+            if d == a_gifter or c == b_giftee:
+                continue
+            rules = AssignmentGenerator.build_constraint_engine([a, b, c, d])
+            if rules.allowed(a, d) and rules.allowed(c, b):
+                return other
+
+        rules = AssignmentGenerator.build_constraint_engine()
+        for other in candidates.yield_per(1000):
+            c, d = other.gifter_user_id, other.giftee_user_id
+            if d != a_gifter and c != b_giftee and rules.allowed(a, d) and rules.allowed(c, b):
+                return other
+
+        raise ValueError("Could not re-link the chain without breaking the exclusion rules; regenerate assignments")
+
+    @staticmethod
+    def reassign(assignment_id, new_giftee_id):
+        """
+        Point a gifter at a new giftee by swapping with whoever currently has
+        that giftee (g->t0, h->t becomes g->t, h->t0), so the result stays a
+        permutation. Returns the ids of the changed assignments.
+        """
+        assignment = Assignment.query.get(assignment_id)
+        if assignment is None:
+            raise ValueError("Assignment not found")
+
+        gifter, old_giftee = assignment.gifter_user_id, assignment.giftee_user_id
+        if gifter == new_giftee_id:
+            raise ValueError("Cannot assign a person to themselves")
+        if old_giftee == new_giftee_id:
+            return []
+
+        other = Assignment.query.filter_by(giftee_user_id=new_giftee_id).first()
+        if other is None:
+            raise ValueError("Selected giftee is not part of the current assignments")
+        if other.gifter_user_id == old_giftee:
+            raise ValueError("That swap would assign a person to themselves")
+
+        new_giftee_gives_to = db.session.query(Assignment.giftee_user_id).filter_by(gifter_user_id=new_giftee_id).scalar()
+        old_giftee_gives_to = db.session.query(Assignment.giftee_user_id).filter_by(gifter_user_id=old_giftee).scalar()
+        if new_giftee_gives_to == gifter or old_giftee_gives_to == other.gifter_user_id:
+            raise ValueError("That swap would make two people gift each other")
+
+        rules = AssignmentGenerator.build_constraint_engine([other.gifter_user_id, old_giftee])
+        if not rules.allowed(other.gifter_user_id, old_giftee):
+            raise ValueError("That swap would give the other gifter a giftee excluded by the matching rules")
+
+        AssignmentGenerator._repoint(assignment, new_giftee_id)
+        AssignmentGenerator._repoint(other, old_giftee)
+        db.session.flush()
+
+        AssignmentGenerator._check_local([gifter, other.gifter_user_id, new_giftee_id, old_giftee])
+        return [assignment.id, other.id]
+
+    @staticmethod
+    def _repoint(assignment, giftee_id):
+        """Give a gifter a new giftee: the old reveal and chat no longer apply"""
+        assignment.giftee_user_id = giftee_id
+        assignment.reveal_completed = False
+        assignment.reveal_time = None
+        AssignmentGenerator._clear_chats([assignment.id])
+
+    @staticmethod
+    def _clear_chats(assignment_ids):
+        ChatSessionCache.mark_stale(db.session, assignment_ids)
+        ChatSearchIndex.remove_after_commit(db.session, db.session.scalars(
+            select(ChatMessage.id).where(ChatMessage.assignment_id.in_(assignment_ids))
+        ).all())
+        for model in (ChatMessage, ChatMessageGifter, ChatMessageGiftee, ChatReadCursor, PendingChatNotification):
+            model.query.filter(model.assignment_id.in_(assignment_ids)).delete(synchronize_session=False)
+
+    @staticmethod
+    def _delete_assignments(assignment_ids):
+        AssignmentGenerator._clear_chats(assignment_ids)
+        Assignment.query.filter(Assignment.id.in_(assignment_ids)).delete(synchronize_session=False)
+
+    @staticmethod
+    def _check_local(user_ids):
+        """
+        Validate the neighbourhood of a repair in O(k): each touched person
+        gives and receives exactly once, never to themselves or their gifter.
+        """
+        user_ids = set(user_ids)
+        rows = db.session.query(Assignment.gifter_user_id, Assignment.giftee_user_id).filter(
+            Assignment.gifter_user_id.in_(user_ids) | Assignment.giftee_user_id.in_(user_ids)
+        ).all()
+
+        gives = defaultdict(list)
+        receives = defaultdict(list)
+        for gifter, giftee in rows:
+            gives[gifter].append(giftee)
+            receives[giftee].append(gifter)
+
+        for user_id in user_ids:
+            if len(gives[user_id]) != 1 or len(receives[user_id]) != 1:
+                raise ValueError(f"Repair left participant {user_id} without exactly one giftee and one gifter")
+            giftee = gives[user_id][0]
+            if giftee == user_id:
+                raise ValueError(f"Repair assigned participant {user_id} to themselves")
+            if giftee in receives[user_id]:
+                raise ValueError(f"Repair made participants {user_id} and {giftee} gift each other")
+
+    @staticmethod
+    def assignment_query(include_details=True):
+        """
+        One joined SELECT over assignments and both users, loading only the
+        columns the caller needs (no ORM objects, no per-row lazy loads).
+        The chat monitor and chat search build on it too.
+        """
+        gifter = aliased(User)
+        giftee = aliased(User)
+        columns = [
+            Assignment.id,
+            Assignment.reveal_completed,
+            Assignment.reveal_time,
+            gifter.id.label('gifter_id'),
+            gifter.name.label('gifter_name'),
+            gifter.email.label('gifter_email'),
+            giftee.id.label('giftee_id'),
+            giftee.name.label('giftee_name'),
+            giftee.email.label('giftee_email'),
+        ]
+        if include_details:
+            columns += [
+                gifter.emp_id.label('gifter_emp_id'),
+                giftee.emp_id.label('giftee_emp_id'),
+                giftee.preferences.label('giftee_preferences'),
+                giftee.address.label('giftee_address'),
+            ]
+
+        return db.session.query(*columns) \
+            .join(gifter, Assignment.gifter_user_id == gifter.id) \
+            .join(giftee, Assignment.giftee_user_id == giftee.id)
+
+    @staticmethod
+    def _row_to_dict(row, include_details=True):
+        result = {
+            'id': row.id,
+            'gifter': {
+                'id': row.gifter_id,
+                'name': row.gifter_name,
+                'email': row.gifter_email
+            },
+            'giftee': {
+                'id': row.giftee_id,
+                'name': row.giftee_name,
+                'email': row.giftee_email
+            },
+            'reveal_completed': row.reveal_completed,
+            'reveal_time': row.reveal_time.isoformat() if row.reveal_time else None
+        }
+        if include_details:
+            result['gifter']['emp_id'] = row.gifter_emp_id
+            result['giftee']['emp_id'] = row.giftee_emp_id
+            result['giftee']['preferences'] = row.giftee_preferences
+            result['giftee']['address'] = row.giftee_address
         return result
+
+    @staticmethod
+    def get_assignment_map():
+        """Get all assignments for admin view (single query)"""
+        rows = AssignmentGenerator.assignment_query().order_by(Assignment.id).all()
+        return [AssignmentGenerator._row_to_dict(row) for row in rows]
+
+    @staticmethod
+    def iter_assignments(include_details=True, batch_size=1000):
+        """Stream assignment rows through a server-side cursor, `batch_size` at a time"""
+        query = AssignmentGenerator.assignment_query(include_details).order_by(Assignment.id)
+        return query.yield_per(batch_size)
+
+    @staticmethod
+    def get_assignment_page(after_id=None, limit=100):
+        """
+        One page of assignments for the admin table, keyset-paginated by id.
+        Returns (assignments, next_after_id); next_after_id is None on the last page.
+        """
+        query = AssignmentGenerator.assignment_query(include_details=False)
+        if after_id:
+            query = query.filter(Assignment.id > after_id)
+        rows = query.order_by(Assignment.id).limit(limit + 1).all()
+
+        next_after_id = rows[limit - 1].id if len(rows) > limit else None
+        return [AssignmentGenerator._row_to_dict(row, include_details=False) for row in rows[:limit]], next_after_id
@@ -1,8 +1,8 @@
 # utils/auth.py
 from functools import wraps
-from flask import session, abort
-from datetime import datetime, timedelta
-from models import LoginAttempt
+from flask import session, abort, g
+from .login_limiter import LoginRateLimiter, LoginAuditLog
+from .participant_context import ParticipantLoader
 
 def admin_required(f):
     @wraps(f)
@@ -22,25 +22,26 @@ def user_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def participant_required(f):
+    """user_required that also puts the user's ParticipantContext on g.participant"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            abort(404)
+        g.participant = ParticipantLoader.get(session['user_id'])
+        if g.participant is None:
+            # Participant deleted (e.g. system reset) while logged in
+            session.pop('user_id', None)
+            abort(404)
+        return f(*args, **kwargs)
+    return decorated_function
+
 def check_rate_limit(ip_address, max_attempts=5, window_minutes=15):
     """Check if IP has exceeded login attempts"""
-    cutoff_time = datetime.utcnow() - timedelta(minutes=window_minutes)
-
-    recent_attempts = LoginAttempt.query.filter(
-        LoginAttempt.ip_address == ip_address,
-        LoginAttempt.timestamp > cutoff_time,
-        LoginAttempt.success == False
-    ).count()
-
-    return recent_attempts < max_attempts
+    return LoginRateLimiter.failures(ip_address, window_minutes * 60) < max_attempts
 
 def log_login_attempt(ip_address, email, success):
     """Log a login attempt"""
-    attempt = LoginAttempt(
-        ip_address=ip_address,
-        email=email,
-        success=success
-    )
-    from models import db
-    db.session.add(attempt)
-    db.session.commit()
+    if not success:
+        LoginRateLimiter.record_failure(ip_address)
+    LoginAuditLog.record(ip_address, email, success)
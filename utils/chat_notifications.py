@@ -0,0 +1,122 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from models import db, User, PendingChatNotification
+
+
+class ChatNotifier:
+    """
+    Debounced "new message" emails.
+
+    The first unread message for a recipient opens a window of
+    CHAT_NOTIFICATION_WINDOW seconds; later messages only bump a counter. When
+    the window closes a single digest email is queued. Reading the chat before
+    that drops the pending notification, so nothing is sent.
+    """
+
+    _started = False
+    _lock = threading.Lock()
+
+    @staticmethod
+    def record_message(assignment, sender_type, count=1):
+        """Count `count` messages for the other party; committed with the messages"""
+        if sender_type == 'gifter':
+            recipient_role, recipient_user_id = 'giftee', assignment.giftee_user_id
+        else:
+            recipient_role, recipient_user_id = 'gifter', assignment.gifter_user_id
+
+        if ChatNotifier._bump(assignment.id, recipient_role, count):
+            return
+
+        window = current_app.config.get('CHAT_NOTIFICATION_WINDOW', 300)
+        now = datetime.utcnow()
+        try:
+            with db.session.begin_nested():
+                db.session.add(PendingChatNotification(
+                    assignment_id=assignment.id,
+                    recipient_role=recipient_role,
+                    recipient_user_id=recipient_user_id,
+                    message_count=count,
+                    first_message_at=now,
+                    due_at=now + timedelta(seconds=window)
+                ))
+        except IntegrityError:
+            # Another message opened the window at the same moment
+            ChatNotifier._bump(assignment.id, recipient_role, count)
+
+    @staticmethod
+    def _bump(assignment_id, recipient_role, count=1):
+        return PendingChatNotification.query.filter_by(
+            assignment_id=assignment_id,
+            recipient_role=recipient_role
+        ).update({
+            'message_count': PendingChatNotification.message_count + count
+        }, synchronize_session=False) > 0
+
+    @staticmethod
+    def clear(assignment_id, recipient_role):
+        """The recipient has read the chat; cancel the pending digest"""
+        PendingChatNotification.query.filter_by(
+            assignment_id=assignment_id,
+            recipient_role=recipient_role
+        ).delete(synchronize_session=False)
+
+    @staticmethod
+    def flush_due(limit=100):
+        """Queue digest emails for every window that has closed"""
+        from .email_service import EmailService
+
+        due = db.session.query(
+            PendingChatNotification.id,
+            PendingChatNotification.recipient_user_id,
+            PendingChatNotification.recipient_role,
+            PendingChatNotification.message_count
+        ).filter(PendingChatNotification.due_at <= datetime.utcnow()) \
+            .order_by(PendingChatNotification.due_at) \
+            .limit(limit) \
+            .all()
+
+        flushed = 0
+        for pending_id, recipient_user_id, recipient_role, message_count in due:
+            # Delete-by-id doubles as the claim when several processes flush;
+            # the delete commits together with the queued email.
+            claimed = PendingChatNotification.query.filter_by(id=pending_id) \
+                .delete(synchronize_session=False)
+            if not claimed:
+                db.session.rollback()
+                continue
+
+            user = db.session.get(User, recipient_user_id)
+            if user:
+                # The gifter's messages reach the giftee as "from your Secret Santa"
+                EmailService.send_new_message_notification(user, recipient_role == 'giftee', message_count)
+                flushed += 1
+            else:
+                db.session.commit()
+
+        return flushed
+
+    @staticmethod
+    def start_worker(app):
+        with ChatNotifier._lock:
+            if ChatNotifier._started:
+                return
+            ChatNotifier._started = True
+
+        threading.Thread(target=ChatNotifier._worker_loop, args=(app,),
+                         name='chat-notifier', daemon=True).start()
+
+    @staticmethod
+    def _worker_loop(app):
+        while True:
+            with app.app_context():
+                try:
+                    ChatNotifier.flush_due()
+                except Exception:
+                    app.logger.exception('Failed to flush chat notification digests')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            time.sleep(app.config.get('CHAT_NOTIFICATION_POLL_INTERVAL', 15))
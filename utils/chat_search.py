@@ -0,0 +1,262 @@
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, Assignment, ChatMessage
+
+
+class ChatSearchIndex:
+    """
+    Full-text index over chat messages for moderation, kept in a local
+    SQLite FTS5 file (CHAT_SEARCH_INDEX_PATH) next to the main database.
+
+    Row ids are chat_messages ids. New messages are indexed right after they
+    are committed, and messages deleted with their chats are dropped once
+    that delete commits. `catch_up` compares every id in chat_messages with
+    the index and fixes both kinds of drift (backfill, messages missed by a
+    crashed worker or committed out of id order, deletes that never reached
+    the index); it runs at startup and every CHAT_SEARCH_RECONCILE_INTERVAL
+    seconds. Search returns message ids; the messages themselves are
+    re-read from the main database, so deleted messages never show up.
+    """
+
+    SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+            message_text,
+            assignment_id UNINDEXED,
+            sent_at UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """
+
+    _local = threading.local()
+    _available = None
+
+    @staticmethod
+    def init_app():
+        event.listen(Session, 'after_commit', ChatSearchIndex._after_commit)
+        event.listen(Session, 'after_rollback', ChatSearchIndex._after_rollback)
+
+    @staticmethod
+    def enabled():
+        if not current_app.config.get('CHAT_SEARCH_ENABLED', True):
+            return False
+        if ChatSearchIndex._available is None:
+            try:
+                ChatSearchIndex._connection()
+                ChatSearchIndex._available = True
+            except sqlite3.Error:
+                current_app.logger.exception('Chat search index unavailable (SQLite without FTS5?)')
+                ChatSearchIndex._available = False
+        return ChatSearchIndex._available
+
+    @staticmethod
+    def _connection():
+        path = current_app.config.get('CHAT_SEARCH_INDEX_PATH', 'chat_search.db')
+        conn = getattr(ChatSearchIndex._local, 'conn', None)
+        if conn is None or ChatSearchIndex._local.path != path:
+            conn = sqlite3.connect(path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(ChatSearchIndex.SCHEMA)
+            ChatSearchIndex._local.conn = conn
+            ChatSearchIndex._local.path = path
+        return conn
+
+    @staticmethod
+    def add(messages):
+        """Index (id, assignment_id, message_text, timestamp) tuples"""
+        if not messages or not ChatSearchIndex.enabled():
+            return 0
+        try:
+            conn = ChatSearchIndex._connection()
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO message_fts (rowid, message_text, assignment_id, sent_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(m[0], m[2], m[1], m[3].isoformat() if m[3] else None) for m in messages]
+                )
+            return len(messages)
+        except sqlite3.Error:
+            # The index is a convenience; never fail a chat send over it
+            current_app.logger.exception('Failed to index chat messages')
+            return 0
+
+    @staticmethod
+    def catch_up(batch_size=5000):
+        """
+        Reconcile the index with chat_messages, one id range at a time: index
+        the messages it lacks and drop the ones that no longer exist. Only
+        ids are compared; message text is read for missing rows only.
+        Returns the number of messages indexed.
+        """
+        if not ChatSearchIndex.enabled():
+            return 0
+        conn = ChatSearchIndex._connection()
+        after_id = 0
+        indexed_total = removed_total = 0
+        while True:
+            ids = db.session.scalars(
+                select(ChatMessage.id).where(ChatMessage.id > after_id).order_by(ChatMessage.id).limit(batch_size)
+            ).all()
+            # The last range is open-ended so index rows above the newest message go too
+            upper = ids[-1] if len(ids) == batch_size else None
+            sql = 'SELECT rowid FROM message_fts WHERE rowid > ?'
+            params = [after_id]
+            if upper is not None:
+                sql += ' AND rowid <= ?'
+                params.append(upper)
+            in_index = {row[0] for row in conn.execute(sql, params)}
+
+            missing = [i for i in ids if i not in in_index]
+            if missing:
+                indexed_total += ChatSearchIndex.add(db.session.query(
+                    ChatMessage.id, ChatMessage.assignment_id, ChatMessage.message_text, ChatMessage.timestamp
+                ).filter(ChatMessage.id.in_(missing)).all())
+
+            stale = in_index.difference(ids)
+            if stale:
+                # Rows committed after the id query above were indexed by now; keep them
+                stale -= set(db.session.scalars(select(ChatMessage.id).where(ChatMessage.id.in_(stale))))
+                ChatSearchIndex.remove(stale)
+                removed_total += len(stale)
+            db.session.rollback()
+
+            if upper is None:
+                break
+            after_id = upper
+
+        if removed_total:
+            current_app.logger.info(f"Dropped {removed_total} deleted chat messages from the search index")
+        return indexed_total
+
+    @staticmethod
+    def remove(message_ids):
+        """Drop deleted messages from the index"""
+        if not message_ids or not ChatSearchIndex.enabled():
+            return
+        try:
+            conn = ChatSearchIndex._connection()
+            with conn:
+                conn.executemany('DELETE FROM message_fts WHERE rowid = ?', [(i,) for i in message_ids])
+        except sqlite3.Error:
+            # catch_up drops them on its next run
+            current_app.logger.exception('Failed to remove chat messages from the search index')
+
+    @staticmethod
+    def remove_after_commit(session, message_ids):
+        """Drop these messages from the index once the current transaction commits"""
+        session.info.setdefault('search_removals', set()).update(message_ids)
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('search_removals', None)
+
+    @staticmethod
+    def _after_commit(session):
+        message_ids = session.info.pop('search_removals', None)
+        if message_ids:
+            ChatSearchIndex.remove(message_ids)
+
+    @staticmethod
+    def clear():
+        if not ChatSearchIndex.enabled():
+            return
+        conn = ChatSearchIndex._connection()
+        with conn:
+            conn.execute('DELETE FROM message_fts')
+
+    @staticmethod
+    def build_match(query):
+        """
+        Turn user input into an FTS5 expression: "quoted text" is a phrase,
+        other words are terms (a trailing * makes a prefix term). All parts
+        must match. Returns None if nothing searchable is left.
+        """
+        parts = []
+        for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query or ''):
+            if phrase:
+                tokens = re.findall(r'\w+', phrase)
+                if tokens:
+                    parts.append('"' + ' '.join(tokens) + '"')
+            else:
+                prefix = word.endswith('*')
+                for token in re.findall(r'\w+', word):
+                    parts.append(f'"{token}"')
+                if prefix and parts:
+                    parts[-1] += '*'
+        return ' AND '.join(parts) or None
+
+    @staticmethod
+    def search(query, assignment_id=None, date_from=None, date_to=None, limit=100):
+        """Matching message ids, newest first"""
+        match = ChatSearchIndex.build_match(query)
+        if not match or not ChatSearchIndex.enabled():
+            return []
+
+        sql = 'SELECT rowid FROM message_fts WHERE message_fts MATCH ?'
+        params = [match]
+        if assignment_id:
+            sql += ' AND assignment_id = ?'
+            params.append(int(assignment_id))
+        if date_from:
+            sql += ' AND sent_at >= ?'
+            params.append(date_from.isoformat())
+        if date_to:
+            sql += ' AND sent_at < ?'
+            params.append(date_to.isoformat())
+        sql += ' ORDER BY rowid DESC LIMIT ?'
+        params.append(limit)
+
+        return [row[0] for row in ChatSearchIndex._connection().execute(sql, params)]
+
+    @staticmethod
+    def load_results(message_ids):
+        """The messages for `message_ids` with both participants' names, newest first"""
+        from .assignment_logic import AssignmentGenerator
+
+        if not message_ids:
+            return []
+        return AssignmentGenerator.assignment_query(include_details=False) \
+            .add_columns(
+                ChatMessage.id.label('message_id'),
+                ChatMessage.sender_type,
+                ChatMessage.message_text,
+                ChatMessage.timestamp
+            ) \
+            .join(ChatMessage, ChatMessage.assignment_id == Assignment.id) \
+            .filter(ChatMessage.id.in_(message_ids)) \
+            .order_by(ChatMessage.id.desc()) \
+            .all()
+
+    @staticmethod
+    def start_catch_up(app):
+        """Reconcile now, then every CHAT_SEARCH_RECONCILE_INTERVAL seconds (0: only now)"""
+        def run():
+            while True:
+                with app.app_context():
+                    try:
+                        indexed = ChatSearchIndex.catch_up()
+                        if indexed:
+                            app.logger.info(f"Indexed {indexed} chat messages for search")
+                    except Exception:
+                        app.logger.exception('Chat search catch-up failed')
+                    finally:
+                        db.session.remove()
+                interval = app.config.get('CHAT_SEARCH_RECONCILE_INTERVAL', 3600)
+                if not interval:
+                    return
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='chat-search-catch-up', daemon=True).start()
+
+    @staticmethod
+    def parse_date(value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d') if value else None
+        except ValueError:
+            return None
@@ -0,0 +1,218 @@
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import case, exists, func, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from models import db, Assignment, ChatMessage, ChatReadCursor
+
+
+class ChatStore:
+    """
+    Chat persistence: chat_messages is the single message log per assignment
+    and chat_read_cursors holds, per participant role, the highest message id
+    that participant has seen, with materialized unread/received counters.
+    Sending is one insert plus one counter bump, reading is one single-row
+    cursor update, and dashboards read the counters instead of counting.
+    """
+
+    @staticmethod
+    def other_role(role):
+        return 'giftee' if role == 'gifter' else 'gifter'
+
+    @staticmethod
+    def append(assignment_id, sender_type, message_text):
+        """Add a message to the log; caller commits"""
+        message = ChatMessage(
+            assignment_id=assignment_id,
+            sender_type=sender_type,
+            message_text=message_text
+        )
+        db.session.add(message)
+        ChatStore.count_received(assignment_id, ChatStore.other_role(sender_type))
+        return message
+
+    @staticmethod
+    def count_received(assignment_id, recipient_role, count=1):
+        """Bump the recipient's unread and received counters; caller commits"""
+        if ChatStore._bump(assignment_id, recipient_role, count):
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(ChatReadCursor(
+                    assignment_id=assignment_id,
+                    role=recipient_role,
+                    last_read_message_id=0,
+                    unread_count=count,
+                    received_count=count
+                ))
+        except IntegrityError:
+            # Created by a concurrent send
+            ChatStore._bump(assignment_id, recipient_role, count)
+
+    @staticmethod
+    def _bump(assignment_id, role, count):
+        return ChatReadCursor.query.filter_by(assignment_id=assignment_id, role=role).update({
+            'unread_count': ChatReadCursor.unread_count + count,
+            'received_count': ChatReadCursor.received_count + count
+        }, synchronize_session=False) > 0
+
+    @staticmethod
+    def history(assignment_id):
+        return ChatMessage.query.filter_by(assignment_id=assignment_id) \
+            .order_by(ChatMessage.timestamp, ChatMessage.id).all()
+
+    @staticmethod
+    def page(assignment_id, before_id=None, limit=50):
+        """
+        The newest `limit` messages older than message `before_id` (or the
+        newest overall), keyset-paginated by (timestamp, id). Returns
+        (messages oldest first, has_more).
+        """
+        query = ChatMessage.query.filter(ChatMessage.assignment_id == assignment_id)
+        if before_id:
+            before_ts = select(ChatMessage.timestamp).where(ChatMessage.id == before_id).scalar_subquery()
+            query = query.filter(
+                (ChatMessage.timestamp < before_ts) |
+                ((ChatMessage.timestamp == before_ts) & (ChatMessage.id < before_id))
+            )
+        rows = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        return rows[:limit][::-1], has_more
+
+    @staticmethod
+    def since(assignment_id, after_id, limit=200):
+        """
+        Messages with id > `after_id` in insert order, for clients catching up
+        after a reconnect. Returns (messages, truncated).
+        """
+        rows = ChatMessage.query.filter(
+            ChatMessage.assignment_id == assignment_id,
+            ChatMessage.id > after_id
+        ).order_by(ChatMessage.id).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
+
+    @staticmethod
+    def mark_read(assignment_id, role, message_id):
+        """Move `role`'s cursor forward to `message_id`; caller commits"""
+        if not message_id:
+            return
+        # Anything that arrived after the page was loaded stays unread
+        still_unread = select(func.count(ChatMessage.id)).where(
+            ChatMessage.assignment_id == assignment_id,
+            ChatMessage.sender_type == ChatStore.other_role(role),
+            ChatMessage.id > message_id
+        ).scalar_subquery()
+        updated = ChatReadCursor.query.filter(
+            ChatReadCursor.assignment_id == assignment_id,
+            ChatReadCursor.role == role,
+            ChatReadCursor.last_read_message_id <= message_id
+        ).update({
+            'last_read_message_id': message_id,
+            'unread_count': still_unread,
+            'updated_at': datetime.utcnow()
+        }, synchronize_session=False)
+        if updated:
+            return
+
+        # First read in this chat (or the cursor is already further along)
+        try:
+            with db.session.begin_nested():
+                db.session.add(ChatReadCursor(
+                    assignment_id=assignment_id,
+                    role=role,
+                    last_read_message_id=message_id
+                ))
+        except IntegrityError:
+            pass
+
+    @staticmethod
+    def unread_counts(assignment_id):
+        """{'gifter': n, 'giftee': m} for one chat, read from the cursors"""
+        counts = {'gifter': 0, 'giftee': 0}
+        counts.update(db.session.query(ChatReadCursor.role, ChatReadCursor.unread_count)
+                      .filter_by(assignment_id=assignment_id).all())
+        return counts
+
+    @staticmethod
+    def total_messages():
+        # Every message is received by exactly one role
+        return db.session.query(func.coalesce(func.sum(ChatReadCursor.received_count), 0)).scalar()
+
+    @staticmethod
+    def rebuild_counters():
+        """
+        Recompute every cursor's counters from the message log and create
+        missing cursors. Returns the number of cursors that were missing or wrong
+        (a created cursor starts at zero, so it is always corrected too).
+        """
+        recipient = case((ChatMessage.sender_type == 'gifter', 'giftee'), else_='gifter')
+        missing = select(ChatMessage.assignment_id, recipient, literal(0), literal(datetime.utcnow())) \
+            .where(~exists().where(
+                (ChatReadCursor.assignment_id == ChatMessage.assignment_id) &
+                (ChatReadCursor.role == recipient)
+            )).distinct()
+        db.session.execute(insert(ChatReadCursor).from_select(
+            ['assignment_id', 'role', 'last_read_message_id', 'updated_at'], missing
+        ))
+
+        received = select(func.count(ChatMessage.id)).where(
+            ChatMessage.assignment_id == ChatReadCursor.assignment_id,
+            ChatMessage.sender_type != ChatReadCursor.role
+        ).scalar_subquery()
+        unread = select(func.count(ChatMessage.id)).where(
+            ChatMessage.assignment_id == ChatReadCursor.assignment_id,
+            ChatMessage.sender_type != ChatReadCursor.role,
+            ChatMessage.id > ChatReadCursor.last_read_message_id
+        ).scalar_subquery()
+        corrected = ChatReadCursor.query.filter(
+            (ChatReadCursor.received_count != received) | (ChatReadCursor.unread_count != unread)
+        ).update({
+            'received_count': received,
+            'unread_count': unread
+        }, synchronize_session=False)
+
+        return corrected
+
+    @staticmethod
+    def admin_page(after_id=None, limit=25):
+        """
+        One page of revealed assignments with participant names for the chat
+        monitor, keyset-paginated by id. Returns (rows, next_after_id).
+        """
+        from .assignment_logic import AssignmentGenerator
+
+        query = AssignmentGenerator.assignment_query(include_details=False) \
+            .filter(Assignment.reveal_completed == True)
+        if after_id:
+            query = query.filter(Assignment.id > after_id)
+        rows = query.order_by(Assignment.id).limit(limit + 1).all()
+
+        next_after_id = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_after_id
+
+    @staticmethod
+    def iter_conversations(rows, batch_size=500):
+        """
+        Yield (row, messages) for each assignment row, in order. All messages
+        come from one query ordered by (assignment, time) and streamed with
+        yield_per, so only one conversation is held in memory at a time.
+        """
+        if not rows:
+            return
+        messages = db.session.query(
+            ChatMessage.assignment_id,
+            ChatMessage.sender_type,
+            ChatMessage.message_text,
+            ChatMessage.timestamp
+        ).filter(ChatMessage.assignment_id.in_([row.id for row in rows])) \
+            .order_by(ChatMessage.assignment_id, ChatMessage.timestamp, ChatMessage.id) \
+            .yield_per(batch_size)
+
+        groups = groupby(messages, key=lambda m: m.assignment_id)
+        assignment_id, group = next(groups, (None, None))
+        for row in rows:
+            if row.id == assignment_id:
+                yield row, list(group)
+                assignment_id, group = next(groups, (None, None))
+            else:
+                yield row, []
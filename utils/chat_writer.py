@@ -0,0 +1,180 @@
+import atexit
+import queue
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from sqlalchemy import insert
+from models import db, ChatMessage
+from .chat_notifications import ChatNotifier
+from .chat_store import ChatStore
+from .chat_search import ChatSearchIndex
+
+
+AssignmentRef = namedtuple('AssignmentRef', 'id gifter_user_id giftee_user_id')
+PendingMessage = namedtuple('PendingMessage', 'assignment sender_type message_text timestamp temp_id')
+
+
+def chat_room(assignment_id):
+    return f'chat_{assignment_id}'
+
+
+class ChatBatchWriter:
+    """
+    Write-behind persistence for chat messages (CHAT_WRITE_BEHIND).
+
+    The socket handler broadcasts a message straight away and hands it to
+    this writer. A single thread collects messages for up to
+    CHAT_WRITE_BATCH_MS (or until CHAT_WRITE_BATCH_SIZE are waiting), writes
+    the whole batch in one transaction and then emits 'message_ack' with the
+    stored ids to each room, which tells the sender the message is durable.
+    Messages still queued when the process dies are lost, so this is off
+    by default.
+    """
+
+    _queue = queue.Queue()
+    _started = False
+    _lock = threading.Lock()
+    _app = None
+    _socketio = None
+
+    @staticmethod
+    def submit(assignment, sender_type, message_text, timestamp, temp_id):
+        ChatBatchWriter._queue.put(PendingMessage(
+            AssignmentRef(assignment.id, assignment.gifter_user_id, assignment.giftee_user_id),
+            sender_type, message_text, timestamp, temp_id
+        ))
+
+    @staticmethod
+    def start(app, socketio=None):
+        with ChatBatchWriter._lock:
+            if ChatBatchWriter._started:
+                return
+            ChatBatchWriter._started = True
+            ChatBatchWriter._app = app
+            ChatBatchWriter._socketio = socketio
+
+        threading.Thread(target=ChatBatchWriter._writer_loop, name='chat-writer', daemon=True).start()
+        atexit.register(ChatBatchWriter.drain)
+
+    @staticmethod
+    def _next_batch(block=True):
+        config = ChatBatchWriter._app.config
+        max_size = config.get('CHAT_WRITE_BATCH_SIZE', 200)
+        window = config.get('CHAT_WRITE_BATCH_MS', 10) / 1000.0
+
+        try:
+            batch = [ChatBatchWriter._queue.get(block=block)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + window
+        while len(batch) < max_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(ChatBatchWriter._queue.get(timeout=remaining))
+                else:
+                    batch.append(ChatBatchWriter._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _writer_loop():
+        app = ChatBatchWriter._app
+        while True:
+            batch = ChatBatchWriter._next_batch()
+            with app.app_context():
+                try:
+                    ChatBatchWriter.write_batch(batch)
+                except Exception:
+                    app.logger.exception(f"Failed to write chat batch of {len(batch)}")
+                finally:
+                    db.session.remove()
+
+    @staticmethod
+    def drain():
+        """Write whatever is queued; used at shutdown and by the benchmark"""
+        app = ChatBatchWriter._app
+        if app is None:
+            return
+        while True:
+            batch = ChatBatchWriter._next_batch(block=False)
+            if not batch:
+                return
+            with app.app_context():
+                try:
+                    ChatBatchWriter.write_batch(batch)
+                finally:
+                    db.session.remove()
+
+    @staticmethod
+    def write_batch(batch):
+        """Persist a batch in one commit, then ack it to the chat rooms"""
+        try:
+            stored = ChatBatchWriter._insert(batch)
+        except Exception:
+            db.session.rollback()
+            # One bad row (e.g. its assignment was just deleted) must not
+            # sink the others: fall back to one transaction per message
+            stored = []
+            for item in batch:
+                try:
+                    stored.extend(ChatBatchWriter._insert([item]))
+                except Exception:
+                    db.session.rollback()
+                    ChatBatchWriter._log().exception(
+                        f"Dropped chat message for assignment {item.assignment.id}")
+                    ChatBatchWriter._emit('message_failed', {'temp_id': item.temp_id}, item.assignment.id)
+
+        acks = defaultdict(list)
+        for item, message_id in stored:
+            acks[item.assignment.id].append({'temp_id': item.temp_id, 'id': message_id})
+        for assignment_id, messages in acks.items():
+            ChatBatchWriter._emit('message_ack', {'messages': messages}, assignment_id)
+        return len(stored)
+
+    @staticmethod
+    def _insert(batch):
+        rows = [
+            {
+                'assignment_id': item.assignment.id,
+                'sender_type': item.sender_type,
+                'message_text': item.message_text,
+                'timestamp': item.timestamp,
+                'read': False
+            }
+            for item in batch
+        ]
+        # One multi-row INSERT ... RETURNING with ids in batch order. SQLite
+        # can't guarantee RETURNING order, and asking for it makes SQLAlchemy
+        # insert row by row; its rowids are handed out in VALUES order, so
+        # sorting them gives the same mapping.
+        if db.engine.dialect.name == 'sqlite':
+            ids = sorted(db.session.scalars(insert(ChatMessage).returning(ChatMessage.id), rows).all())
+        else:
+            ids = db.session.scalars(
+                insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True), rows
+            ).all()
+
+        # One counter update per (chat, sender) instead of per message
+        counts = Counter((item.assignment, item.sender_type) for item in batch)
+        for (assignment, sender_type), count in counts.items():
+            ChatStore.count_received(assignment.id, ChatStore.other_role(sender_type), count)
+            ChatNotifier.record_message(assignment, sender_type, count)
+
+        db.session.commit()
+        ChatSearchIndex.add([
+            (message_id, item.assignment.id, item.message_text, item.timestamp)
+            for item, message_id in zip(batch, ids)
+        ])
+        return list(zip(batch, ids))
+
+    @staticmethod
+    def _emit(event, payload, assignment_id):
+        if ChatBatchWriter._socketio is not None:
+            ChatBatchWriter._socketio.emit(event, payload, room=chat_room(assignment_id))
+
+    @staticmethod
+    def _log():
+        return ChatBatchWriter._app.logger
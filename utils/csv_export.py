@@ -0,0 +1,48 @@
+import csv
+import zlib
+from io import StringIO
+from flask import Response, stream_with_context
+
+
+def iter_csv(header, rows, compress=False, flush_every=500):
+    """
+    Yield CSV output in chunks as `rows` is consumed, optionally gzipped on
+    the fly. Memory stays bounded by `flush_every` rows.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    # wbits=31 selects the gzip container
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % flush_every == 0:
+            chunk = drain()
+            if chunk:
+                yield chunk
+
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def csv_response(filename, header, rows, compress=False):
+    """Streamed CSV download; rows are fetched while the response is sent"""
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv'
+
+    response = Response(stream_with_context(iter_csv(header, rows, compress)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
@@ -0,0 +1,134 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, EmailOutbox
+
+
+class EmailQueue:
+    """Persistent outbox for outgoing email, drained by background workers."""
+
+    _started = False
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enqueue(to_email, subject, html_content, text_content=None):
+        """Store a message in the outbox; delivery happens in a worker"""
+        message = EmailOutbox(
+            to_email=to_email,
+            subject=subject,
+            html_content=html_content,
+            text_content=text_content
+        )
+        db.session.add(message)
+        db.session.commit()
+        return message
+
+    @staticmethod
+    def start_workers(app, num_workers=None):
+        """Start the delivery worker pool (once per process)"""
+        with EmailQueue._lock:
+            if EmailQueue._started:
+                return
+            EmailQueue._started = True
+
+        num_workers = num_workers or app.config.get('EMAIL_WORKERS', 2)
+        for i in range(num_workers):
+            threading.Thread(
+                target=EmailQueue._worker_loop,
+                args=(app,),
+                name=f'email-worker-{i}',
+                daemon=True
+            ).start()
+
+    @staticmethod
+    def _worker_loop(app):
+        while True:
+            delivered = 0
+            with app.app_context():
+                try:
+                    delivered = EmailQueue.process_batch()
+                except Exception:
+                    app.logger.exception('Email worker failed to process outbox')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+            if not delivered:
+                time.sleep(app.config.get('EMAIL_POLL_INTERVAL', 2))
+
+    @staticmethod
+    def _ready_filter(now):
+        # Pending messages whose retry time has come, plus messages claimed by
+        # a worker that died before finishing (expired lease).
+        return (
+            ((EmailOutbox.status == 'pending') & (EmailOutbox.next_attempt_at <= now)) |
+            ((EmailOutbox.status == 'sending') & (EmailOutbox.locked_until < now))
+        )
+
+    @staticmethod
+    def _claim(message_id, now):
+        """Atomically mark a message as ours; False if another worker won"""
+        lease = current_app.config.get('EMAIL_LEASE_SECONDS', 120)
+        claimed = EmailOutbox.query.filter(
+            EmailOutbox.id == message_id,
+            EmailQueue._ready_filter(now)
+        ).update({
+            'status': 'sending',
+            'locked_until': now + timedelta(seconds=lease),
+            'attempts': EmailOutbox.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    @staticmethod
+    def process_batch(limit=None):
+        """Deliver up to `limit` ready messages; returns how many were attempted"""
+        from .email_service import EmailService
+
+        limit = limit or current_app.config.get('EMAIL_BATCH_SIZE', 10)
+        now = datetime.utcnow()
+
+        candidate_ids = [row.id for row in db.session.query(EmailOutbox.id)
+                         .filter(EmailQueue._ready_filter(now))
+                         .order_by(EmailOutbox.id)
+                         .limit(limit)
+                         .all()]
+
+        attempted = 0
+        for message_id in candidate_ids:
+            if not EmailQueue._claim(message_id, now):
+                continue
+            attempted += 1
+
+            message = db.session.get(EmailOutbox, message_id)
+            success = EmailService.send_email(
+                message.to_email,
+                message.subject,
+                message.html_content,
+                message.text_content
+            )
+            EmailQueue._record_result(message, success)
+
+        return attempted
+
+    @staticmethod
+    def _record_result(message, success):
+        now = datetime.utcnow()
+        message.locked_until = None
+
+        if success:
+            message.status = 'sent'
+            message.sent_at = now
+            message.last_error = None
+        elif message.attempts >= current_app.config.get('EMAIL_MAX_ATTEMPTS', 5):
+            message.status = 'failed'
+            message.last_error = 'Delivery failed, giving up (see application log)'
+            current_app.logger.error(f"Giving up on email {message.id} to {message.to_email}")
+        else:
+            backoff = current_app.config.get('EMAIL_RETRY_BACKOFF', 30) * 2 ** (message.attempts - 1)
+            message.status = 'pending'
+            message.next_attempt_at = now + timedelta(seconds=backoff)
+            message.last_error = 'Delivery failed, will retry (see application log)'
+
+        db.session.commit()
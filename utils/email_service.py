@@ -1,13 +1,20 @@
 # utils/email_service.py
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import render_template, current_app
 from models import SystemSettings
+from .email_queue import EmailQueue
+from .smtp_pool import SMTPConnectionPool
 import os
 
 class EmailService:
 
+    _pool = None
+    _pool_key = None
+    _pool_lock = threading.Lock()
+
     @staticmethod
     def get_smtp_config():
         return {
@@ -18,6 +25,23 @@ class EmailService:
             'use_tls': True
         }
 
+    @staticmethod
+    def get_smtp_pool(config):
+        """Shared SMTP session pool, rebuilt when the SMTP settings change"""
+        key = (config['host'], config['port'], config['user'], config['password'], config.get('use_tls', True))
+        with EmailService._pool_lock:
+            if EmailService._pool is None or EmailService._pool_key != key:
+                if EmailService._pool is not None:
+                    EmailService._pool.close_all()
+                EmailService._pool = SMTPConnectionPool(
+                    config,
+                    size=current_app.config.get('SMTP_POOL_SIZE', 4),
+                    max_messages=current_app.config.get('SMTP_MAX_MESSAGES_PER_SESSION', 100),
+                    idle_timeout=current_app.config.get('SMTP_SESSION_IDLE_TIMEOUT', 60)
+                )
+                EmailService._pool_key = key
+            return EmailService._pool
+
     @staticmethod
     def send_email(to_email, subject, html_content, text_content=None):
         config = EmailService.get_smtp_config()
@@ -39,25 +63,9 @@ class EmailService:
             part2 = MIMEText(html_content, 'html')
             msg.attach(part2)
 
-            server = None
             try:
-                if config.get('port') == 465:
-                    current_app.logger.info(f"Connecting to {config['host']}:465 with SSL")
-                    server = smtplib.SMTP_SSL(config['host'], 465, timeout=30)
-                else:
-                    current_app.logger.info(f"Connecting to {config['host']}:{config['port']} with STARTTLS")
-                    server = smtplib.SMTP(config['host'], config['port'], timeout=30)
-                    server.ehlo()
-                    if config.get('use_tls', True):
-                        server.starttls()
-                        server.ehlo()
-
-                current_app.logger.info(f"Logging in as {config['user']}")
-                server.login(config['user'], config['password'])
-
                 current_app.logger.info(f"Sending email to {to_email}")
-                server.send_message(msg)
-                server.quit()
+                EmailService.get_smtp_pool(config).send_message(msg)
 
                 current_app.logger.info(f"Email sent successfully to {to_email}")
                 return True
@@ -68,12 +76,6 @@ class EmailService:
             except smtplib.SMTPException as e:
                 current_app.logger.error(f"SMTP error: {str(e)}")
                 return False
-            finally:
-                if server:
-                    try:
-                        server.quit()
-                    except:
-                        pass
 
         except Exception as e:
             current_app.logger.error(f"Error sending email: {str(e)}")
@@ -105,7 +107,7 @@ class EmailService:
         Secret Santa Team
         """
 
-        return EmailService.send_email(
+        return EmailQueue.enqueue(
             user.email,
             "Secret Santa Registration Confirmed",
             html_content,
@@ -113,7 +115,8 @@ class EmailService:
         )
 
     @staticmethod
-    def send_phase2_announcement(user, login_url):
+    def phase2_announcement_content(user, login_url):
+        """Subject, HTML and text body of the Phase 2 announcement"""
         html_content = render_template(
             'emails/phase2_announcement.html',
             user=user,
@@ -134,23 +137,22 @@ class EmailService:
         Secret Santa Team
         """
 
-        return EmailService.send_email(
-            user.email,
-            "Your Secret Santa Match is Ready!",
-            html_content,
-            text_content
-        )
+        return "Your Secret Santa Match is Ready!", html_content, text_content
 
     @staticmethod
-    def send_new_message_notification(user, is_gifter):
+    def send_new_message_notification(user, is_gifter, message_count=1):
         role = "Secret Santa" if is_gifter else "your giftee"
+        if message_count == 1:
+            summary = f"a new message from {role}"
+        else:
+            summary = f"{message_count} new messages from {role}"
 
         html_content = f"""
         <html>
             <body>
                 <h2>New Message!</h2>
                 <p>Hi {user.name},</p>
-                <p>You have received a new message from {role} in the Secret Santa chat.</p>
+                <p>You have received {summary} in the Secret Santa chat.</p>
                 <p><a href="{{{{ url }}}}">Click here to view</a></p>
             </body>
         </html>
@@ -159,14 +161,14 @@ class EmailService:
         text_content = f"""
         Hi {user.name},
 
-        You have received a new message from {role} in the Secret Santa chat.
+        You have received {summary} in the Secret Santa chat.
 
         Login to view your messages.
         """
 
-        return EmailService.send_email(
+        return EmailQueue.enqueue(
             user.email,
-            "New Secret Santa Message",
+            "New Secret Santa Message" if message_count == 1 else f"{message_count} New Secret Santa Messages",
             html_content,
             text_content
         )
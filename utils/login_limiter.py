@@ -0,0 +1,231 @@
+import atexit
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, LoginAttempt
+
+
+class MemoryWindow:
+    """Sliding-window log of failures per key, local to this process"""
+
+    MAX_EVENTS = 100  # per key; no limit checked against is higher than this
+
+    def __init__(self):
+        self._events = {}  # key -> deque of monotonic timestamps
+        self._lock = threading.Lock()
+        self._longest_window = 0
+        self._next_sweep = 0
+
+    def count(self, key, window):
+        now = time.monotonic()
+        with self._lock:
+            self._longest_window = max(self._longest_window, window)
+            events = self._events.get(key)
+            if not events:
+                return 0
+            cutoff = now - window
+            return sum(1 for t in events if t > cutoff)
+
+    def add(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                events = self._events[key] = deque(maxlen=MemoryWindow.MAX_EVENTS)
+            events.append(now)
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+    def _sweep(self, now):
+        # Forget keys whose newest failure is older than any window we check
+        cutoff = now - self._longest_window
+        for key in [k for k, events in self._events.items() if events[-1] <= cutoff]:
+            del self._events[key]
+        self._next_sweep = now + max(self._longest_window, 60)
+
+
+class RedisWindow:
+    """The same sliding window in Redis sorted sets, shared by all workers"""
+
+    def __init__(self, url, prefix='santa:login-failures:'):
+        import redis  # optional dependency, only needed for redis:// storage
+
+        # Short timeouts: a slow Redis must not stall the login page
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._prefix = prefix
+        self._longest_window = 15 * 60
+
+    def count(self, key, window):
+        self._longest_window = max(self._longest_window, window)
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.zremrangebyscore(self._prefix + key, 0, now - window)
+        pipe.zcard(self._prefix + key)
+        return pipe.execute()[1]
+
+    def add(self, key):
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.zadd(self._prefix + key, {f'{now}:{uuid.uuid4().hex[:8]}': now})
+        pipe.expire(self._prefix + key, int(self._longest_window) + 1)
+        pipe.execute()
+
+
+class LoginRateLimiter:
+    """
+    Failed-login counter behind check_rate_limit. Lives in process memory
+    by default (per worker, reset on restart); RATELIMIT_STORAGE_URL=redis://...
+    shares it between workers. If Redis is unreachable the local window is
+    used instead of failing the login.
+    """
+
+    _backend = None
+    _fallback = MemoryWindow()
+
+    @staticmethod
+    def init_app(app):
+        url = app.config.get('RATELIMIT_STORAGE_URL') or 'memory://'
+        backend = LoginRateLimiter._fallback
+        if url.startswith(('redis://', 'rediss://')):
+            try:
+                backend = RedisWindow(url)
+            except ImportError:
+                app.logger.warning('RATELIMIT_STORAGE_URL needs the redis package; using in-memory rate limits')
+        elif not url.startswith('memory://'):
+            app.logger.warning(f"Unsupported RATELIMIT_STORAGE_URL {url!r}; using in-memory rate limits")
+        LoginRateLimiter._backend = backend
+
+    @staticmethod
+    def _get_backend():
+        if LoginRateLimiter._backend is None:
+            LoginRateLimiter._backend = LoginRateLimiter._fallback
+        return LoginRateLimiter._backend
+
+    @staticmethod
+    def failures(key, window_seconds):
+        backend = LoginRateLimiter._get_backend()
+        try:
+            return backend.count(key, window_seconds)
+        except Exception:
+            if backend is LoginRateLimiter._fallback:
+                raise
+            return LoginRateLimiter._fallback.count(key, window_seconds)
+
+    @staticmethod
+    def record_failure(key):
+        backend = LoginRateLimiter._get_backend()
+        try:
+            backend.add(key)
+        except Exception:
+            if backend is LoginRateLimiter._fallback:
+                raise
+            LoginRateLimiter._fallback.add(key)
+
+
+class LoginAuditLog:
+    """
+    Writes login_attempts rows from a background thread in batches of up to
+    LOGIN_AUDIT_BATCH_SIZE, at most LOGIN_AUDIT_FLUSH_SECONDS apart. The
+    queue is bounded (LOGIN_AUDIT_QUEUE_SIZE); during a flood the excess
+    rows are dropped and counted in the log rather than queued without end.
+    Until start() is called (CLI commands, scripts) rows are written inline.
+    """
+
+    _queue = None
+    _started = False
+    _lock = threading.Lock()
+    _app = None
+    _dropped = 0
+
+    @staticmethod
+    def start(app):
+        with LoginAuditLog._lock:
+            if LoginAuditLog._started:
+                return
+            LoginAuditLog._started = True
+            LoginAuditLog._app = app
+            LoginAuditLog._queue = queue.Queue(maxsize=app.config.get('LOGIN_AUDIT_QUEUE_SIZE', 10000))
+
+        threading.Thread(target=LoginAuditLog._writer_loop, name='login-audit', daemon=True).start()
+        atexit.register(LoginAuditLog.drain)
+
+    @staticmethod
+    def record(ip_address, email, success):
+        row = {'ip_address': ip_address, 'email': email, 'success': success, 'timestamp': datetime.utcnow()}
+        if not LoginAuditLog._started:
+            LoginAuditLog.write_batch([row])
+            return
+        try:
+            LoginAuditLog._queue.put_nowait(row)
+        except queue.Full:
+            with LoginAuditLog._lock:
+                LoginAuditLog._dropped += 1
+
+    @staticmethod
+    def _next_batch(block=True):
+        config = LoginAuditLog._app.config
+        max_size = config.get('LOGIN_AUDIT_BATCH_SIZE', 100)
+        window = config.get('LOGIN_AUDIT_FLUSH_SECONDS', 1.0)
+
+        try:
+            batch = [LoginAuditLog._queue.get(block=block)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + window
+        while len(batch) < max_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(LoginAuditLog._queue.get(timeout=remaining))
+                else:
+                    batch.append(LoginAuditLog._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _writer_loop():
+        app = LoginAuditLog._app
+        while True:
+            batch = LoginAuditLog._next_batch()
+            with app.app_context():
+                try:
+                    LoginAuditLog.write_batch(batch)
+                except Exception:
+                    app.logger.exception(f"Failed to write {len(batch)} login audit rows")
+                finally:
+                    db.session.remove()
+            LoginAuditLog._report_dropped()
+
+    @staticmethod
+    def drain():
+        """Write whatever is queued; used at shutdown"""
+        app = LoginAuditLog._app
+        if app is None:
+            return
+        while True:
+            batch = LoginAuditLog._next_batch(block=False)
+            if not batch:
+                return
+            with app.app_context():
+                try:
+                    LoginAuditLog.write_batch(batch)
+                finally:
+                    db.session.remove()
+
+    @staticmethod
+    def write_batch(rows):
+        db.session.execute(insert(LoginAttempt), rows)
+        db.session.commit()
+
+    @staticmethod
+    def _report_dropped():
+        with LoginAuditLog._lock:
+            dropped, LoginAuditLog._dropped = LoginAuditLog._dropped, 0
+        if dropped:
+            LoginAuditLog._app.logger.warning(f"Login audit queue full; dropped {dropped} rows")
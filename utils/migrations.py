@@ -0,0 +1,152 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import exists, func, insert, inspect, literal, select, text
+from sqlalchemy.exc import IntegrityError
+from models import db, ChatMessage, ChatMessageGifter, ChatMessageGiftee, ChatReadCursor, LoginAttempt, SchemaMigration
+
+
+def _column_exists(table, column):
+    return column in {c['name'] for c in inspect(db.engine).get_columns(table)}
+
+
+def _add_column(table, column, ddl_type):
+    """Add a column if it is missing (idempotent); must be nullable or have a default"""
+    if _column_exists(table, column):
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD {column} {ddl_type}"))
+    return True
+
+
+def _add_index(table, index_name):
+    """Create one of a model's declared indexes if the table predates it"""
+    existing = {i['name'] for i in inspect(db.engine).get_indexes(table.name)}
+    if index_name in existing:
+        return False
+    index = next(i for i in table.indexes if i.name == index_name)
+    index.create(db.engine)
+    return True
+
+
+def missing_indexes(bind=None):
+    """Indexes declared on the models that the database lacks (tables that exist only)"""
+    inspector = inspect(bind or db.engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {i['name'] for i in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+
+def add_users_team():
+    return _add_column('users', 'team', 'VARCHAR(100)')
+
+
+def merge_role_chat_tables():
+    """
+    Move chat history from the per-role copies (chat_messages_gifter /
+    chat_messages_giftee) to the single chat_messages log, and turn their
+    read flags into read cursors.
+    """
+    changed = False
+    with db.engine.begin() as conn:
+        # Messages that only exist in a role table
+        for source in (ChatMessageGifter, ChatMessageGiftee):
+            result = conn.execute(insert(ChatMessage).from_select(
+                ['assignment_id', 'sender_type', 'message_text', 'timestamp', 'read'],
+                select(source.assignment_id, source.sender_type, source.message_text,
+                       source.timestamp, source.read)
+                .where(~exists().where(ChatMessage.assignment_id == source.assignment_id))
+                .order_by(source.timestamp, source.id)
+            ))
+            changed = changed or result.rowcount > 0
+
+        # A role has read everything up to its newest read message from the other party
+        now = datetime.utcnow()
+        for role, source, sender in (('gifter', ChatMessageGifter, 'giftee'),
+                                     ('giftee', ChatMessageGiftee, 'gifter')):
+            read_until = select(
+                source.assignment_id.label('assignment_id'),
+                func.max(source.timestamp).label('read_until')
+            ).where(source.sender_type == sender, source.read == True) \
+                .group_by(source.assignment_id).subquery()
+
+            last_read_id = select(func.coalesce(func.max(ChatMessage.id), 0)).where(
+                ChatMessage.assignment_id == read_until.c.assignment_id,
+                ChatMessage.timestamp <= read_until.c.read_until
+            ).scalar_subquery()
+
+            result = conn.execute(insert(ChatReadCursor).from_select(
+                ['assignment_id', 'role', 'last_read_message_id', 'updated_at'],
+                select(read_until.c.assignment_id, literal(role), last_read_id, literal(now))
+                .where(~exists().where(
+                    (ChatReadCursor.assignment_id == read_until.c.assignment_id) &
+                    (ChatReadCursor.role == role)
+                ))
+            ))
+            changed = changed or result.rowcount > 0
+
+    return changed
+
+
+def add_chat_cursor_counters():
+    added = [
+        _add_column('chat_read_cursors', 'unread_count', 'INTEGER NOT NULL DEFAULT 0'),
+        _add_column('chat_read_cursors', 'received_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ]
+    # Cursors predating the counters (or from merge_role_chat_tables) start empty
+    from .chat_store import ChatStore
+    fixed = ChatStore.rebuild_counters()
+    db.session.commit()
+    return any(added) or fixed > 0
+
+
+def add_settings_version():
+    return _add_column('system_settings', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def add_login_attempts_index():
+    return _add_index(LoginAttempt.__table__, 'ix_login_attempts_ip_timestamp')
+
+
+def add_hot_path_indexes():
+    created = missing_indexes()
+    for index in created:
+        current_app.logger.info(f"Creating index {index.name}")
+        index.create(db.engine)
+    return bool(created)
+
+
+# Schema changes that db.create_all() cannot apply to existing tables, and
+# one-off data migrations. Each migration must be idempotent and return True
+# when it changed something; applied names are recorded in schema_migrations.
+MIGRATIONS = [
+    ('add_users_team', add_users_team),
+    ('merge_role_chat_tables', merge_role_chat_tables),
+    ('add_chat_cursor_counters', add_chat_cursor_counters),
+    ('add_login_attempts_index', add_login_attempts_index),
+    ('add_settings_version', add_settings_version),
+    ('add_hot_path_indexes', add_hot_path_indexes),
+]
+
+
+def run_migrations():
+    """Apply pending migrations; safe to run on every startup"""
+    done = {name for (name,) in db.session.query(SchemaMigration.name).all()}
+    applied = []
+    for name, migration in MIGRATIONS:
+        if name in done:
+            continue
+        if migration():
+            current_app.logger.info(f"Applied migration {name}")
+            applied.append(name)
+        try:
+            db.session.add(SchemaMigration(name=name))
+            db.session.commit()
+        except IntegrityError:
+            # Another process applied it at the same time
+            db.session.rollback()
+    return applied
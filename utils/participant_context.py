@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import and_, select
+from sqlalchemy.orm import aliased
+from models import db, User, Assignment, ChatReadCursor
+
+
+UserSnapshot = namedtuple('UserSnapshot', [c.key for c in User.__table__.columns])
+AssignmentSnapshot = namedtuple('AssignmentSnapshot', [c.key for c in Assignment.__table__.columns])
+
+# as_gifter: the assignment where the user gives (counterpart `giftee`);
+# as_giftee: the one where they receive. The gifter's identity is never
+# loaded, so it cannot leak into a participant page. Unread counts are for
+# the user's side of each chat.
+ParticipantContext = namedtuple(
+    'ParticipantContext',
+    'user as_gifter giftee unread_as_gifter as_giftee unread_as_giftee'
+)
+
+
+class ParticipantLoader:
+    """
+    Loads a participant with both of their assignments, their giftee and
+    their unread counts in one SELECT, as read-only snapshots.
+
+    With PARTICIPANT_CACHE_TTL > 0 the result is reused for that many
+    seconds. Reading a chat or revealing drops the user's entry, and any
+    commit that changes assignment participants drops every entry in this
+    process; other workers can lag by up to the TTL.
+    """
+
+    _cache = {}  # user_id -> (expires_at, ParticipantContext)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(user_id):
+        ttl = current_app.config.get('PARTICIPANT_CACHE_TTL', 0)
+        if ttl:
+            cached = ParticipantLoader._cache.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+
+        context = ParticipantLoader.load(user_id)
+        if ttl and context is not None:
+            with ParticipantLoader._lock:
+                ParticipantLoader._cache[user_id] = (time.monotonic() + ttl, context)
+        return context
+
+    @staticmethod
+    def load(user_id):
+        gives, receives = aliased(Assignment), aliased(Assignment)
+        giftee = aliased(User)
+        gives_cursor, receives_cursor = aliased(ChatReadCursor), aliased(ChatReadCursor)
+
+        def columns(entity, model):
+            return [getattr(entity, c.key) for c in model.__table__.columns]
+
+        user_cols = columns(User, User)
+        assignment_cols = columns(gives, Assignment)
+        row = db.session.execute(
+            select(
+                *user_cols,
+                *assignment_cols, *columns(giftee, User), gives_cursor.unread_count,
+                *columns(receives, Assignment), receives_cursor.unread_count
+            )
+            .select_from(User)
+            .outerjoin(gives, gives.gifter_user_id == User.id)
+            .outerjoin(giftee, giftee.id == gives.giftee_user_id)
+            .outerjoin(gives_cursor, and_(gives_cursor.assignment_id == gives.id, gives_cursor.role == 'gifter'))
+            .outerjoin(receives, receives.giftee_user_id == User.id)
+            .outerjoin(receives_cursor, and_(receives_cursor.assignment_id == receives.id,
+                                             receives_cursor.role == 'giftee'))
+            .where(User.id == user_id)
+            .limit(1)
+        ).first()
+        if row is None:
+            return None
+
+        values = iter(row)
+
+        def take(snapshot_type, count):
+            fields = [next(values) for _ in range(count)]
+            return snapshot_type(*fields) if fields[0] is not None else None
+
+        user = take(UserSnapshot, len(user_cols))
+        as_gifter = take(AssignmentSnapshot, len(assignment_cols))
+        giftee_user = take(UserSnapshot, len(user_cols))
+        unread_as_gifter = next(values) or 0
+        as_giftee = take(AssignmentSnapshot, len(assignment_cols))
+        unread_as_giftee = next(values) or 0
+        return ParticipantContext(user, as_gifter, giftee_user, unread_as_gifter,
+                                  as_giftee, unread_as_giftee)
+
+    @staticmethod
+    def invalidate(user_id=None):
+        with ParticipantLoader._lock:
+            if user_id is None:
+                ParticipantLoader._cache.clear()
+            else:
+                ParticipantLoader._cache.pop(user_id, None)
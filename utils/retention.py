@@ -0,0 +1,163 @@
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, select
+from models import db, ChatMessage, ChatMessageGifter, ChatMessageGiftee, LoginAttempt
+from .chat_search import ChatSearchIndex
+
+
+class DataRetention:
+    """
+    Deletes rows older than their table's TTL (RETENTION_DAYS, in days; 0 or
+    None keeps everything).
+
+    Rows go oldest id first in chunks of RETENTION_CHUNK_SIZE, one short
+    transaction each, with a pause in between. SQL Server escalates to a
+    table lock at about 5000 row locks in a statement, so chunks stay under
+    that. If RETENTION_ARCHIVE_DIR is set, each chunk is appended to
+    <table>-<run time>.ndjson.gz and synced before it is deleted. Archiving
+    is at-least-once: a chunk whose delete fails is archived again on the
+    next run.
+
+    The background job (RETENTION_ENABLED) should run in one process only;
+    with several workers use `flask purge-old-data` from cron instead.
+    """
+
+    # table name -> (model, column the TTL applies to)
+    TABLES = {
+        'login_attempts': (LoginAttempt, LoginAttempt.timestamp),
+        'chat_messages': (ChatMessage, ChatMessage.timestamp),
+        'chat_messages_gifter': (ChatMessageGifter, ChatMessageGifter.timestamp),
+        'chat_messages_giftee': (ChatMessageGiftee, ChatMessageGiftee.timestamp),
+    }
+
+    _started = False
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start(app):
+        with DataRetention._lock:
+            if DataRetention._started:
+                return
+            DataRetention._started = True
+
+        threading.Thread(target=DataRetention._loop, args=(app,), name='data-retention', daemon=True).start()
+
+    @staticmethod
+    def _loop(app):
+        while True:
+            with app.app_context():
+                try:
+                    purged = DataRetention.run()
+                    if any(purged.values()):
+                        app.logger.info(f"Retention purge: {purged}")
+                except Exception:
+                    app.logger.exception('Retention purge failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            time.sleep(app.config.get('RETENTION_INTERVAL', 6 * 3600))
+
+    @staticmethod
+    def run(dry_run=False):
+        """Purge every table with a TTL; returns {table: rows purged (or due, if dry_run)}"""
+        policies = current_app.config.get('RETENTION_DAYS') or {}
+        now = datetime.utcnow()
+        purged = {}
+        for name, days in policies.items():
+            if not days or name not in DataRetention.TABLES:
+                continue
+            cutoff = now - timedelta(days=days)
+            if dry_run:
+                purged[name] = DataRetention.count_due(name, cutoff)
+            else:
+                purged[name] = DataRetention.purge(name, cutoff, run_started=now)
+
+        if purged.get('chat_messages') and not dry_run:
+            # Unread/received counters still include the purged messages
+            from .chat_store import ChatStore
+            ChatStore.rebuild_counters()
+            db.session.commit()
+        return purged
+
+    @staticmethod
+    def count_due(name, cutoff):
+        model, timestamp = DataRetention.TABLES[name]
+        return db.session.query(func.count(model.id)).filter(timestamp < cutoff).scalar()
+
+    @staticmethod
+    def purge(name, cutoff, run_started=None):
+        """Delete rows of `name` older than `cutoff` in chunks; returns the number deleted"""
+        model, timestamp = DataRetention.TABLES[name]
+        config = current_app.config
+        chunk_size = config.get('RETENTION_CHUNK_SIZE', 4000)
+        pause = config.get('RETENTION_CHUNK_PAUSE', 0.2)
+        archive_dir = config.get('RETENTION_ARCHIVE_DIR')
+
+        archive = None
+        total = 0
+        try:
+            while True:
+                if archive_dir:
+                    rows = db.session.execute(
+                        select(model.__table__).where(timestamp < cutoff).order_by(model.id).limit(chunk_size)
+                    ).mappings().all()
+                    ids = [row['id'] for row in rows]
+                else:
+                    ids = db.session.scalars(
+                        select(model.id).where(timestamp < cutoff).order_by(model.id).limit(chunk_size)
+                    ).all()
+                if not ids:
+                    db.session.rollback()
+                    return total
+
+                if archive_dir:
+                    if archive is None:
+                        archive = DataRetention._open_archive(archive_dir, name, run_started or datetime.utcnow())
+                    DataRetention._write_archive(archive, rows)
+
+                # Ids are ascending, so the range plus the cutoff is exactly this
+                # chunk and stays one statement however big the chunk is
+                deleted = db.session.query(model).filter(
+                    model.id >= ids[0], model.id <= ids[-1], timestamp < cutoff
+                ).delete(synchronize_session=False)
+                db.session.commit()
+                total += deleted
+
+                if model is ChatMessage:
+                    ChatSearchIndex.remove(ids)
+                if len(ids) < chunk_size:
+                    return total
+                time.sleep(pause)
+        finally:
+            if archive is not None:
+                archive[0].close()
+                archive[1].close()
+
+    @staticmethod
+    def _open_archive(archive_dir, name, run_started):
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, f"{name}-{run_started.strftime('%Y%m%dT%H%M%S')}.ndjson.gz")
+        raw = open(path, 'ab')
+        return gzip.GzipFile(fileobj=raw, mode='ab'), raw
+
+    @staticmethod
+    def _write_archive(archive, rows):
+        compressed, raw = archive
+        for row in rows:
+            line = json.dumps(dict(row), default=DataRetention._json_value, ensure_ascii=False)
+            compressed.write(line.encode('utf-8') + b'\n')
+        # On disk before the rows are deleted
+        compressed.flush()
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    @staticmethod
+    def _json_value(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
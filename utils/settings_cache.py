@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, SystemSettings
+
+
+SettingsSnapshot = namedtuple('SettingsSnapshot', [c.key for c in SystemSettings.__table__.columns])
+
+
+class SettingsCache:
+    """
+    Read-only copy of the system_settings row, shared by all requests in
+    this process.
+
+    Every flush that changes the row also increments its `version`. The
+    process that committed the change drops its copy at once; other
+    processes compare versions with a one-column query at most every
+    SETTINGS_MAX_STALENESS seconds and reload the row only if it changed.
+    Code that modifies settings must still load the ORM row itself.
+    """
+
+    _snapshot = None
+    _checked_until = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app():
+        event.listen(Session, 'before_flush', SettingsCache._before_flush)
+        event.listen(Session, 'after_commit', SettingsCache._after_commit)
+        event.listen(Session, 'after_rollback', SettingsCache._after_rollback)
+
+    @staticmethod
+    def get():
+        snapshot = SettingsCache._snapshot
+        if snapshot is not None and time.monotonic() < SettingsCache._checked_until:
+            return snapshot
+
+        with SettingsCache._lock:
+            # Another thread may have refreshed it while we waited
+            snapshot = SettingsCache._snapshot
+            if snapshot is not None and time.monotonic() < SettingsCache._checked_until:
+                return snapshot
+
+            version = db.session.query(SystemSettings.version).first()
+            if version is None:
+                return None
+            if snapshot is None or snapshot.version != version[0]:
+                row = db.session.query(*SystemSettings.__table__.columns).first()
+                snapshot = SettingsSnapshot(*row)
+                SettingsCache._snapshot = snapshot
+            SettingsCache._checked_until = time.monotonic() + current_app.config.get('SETTINGS_MAX_STALENESS', 5)
+            return snapshot
+
+    @staticmethod
+    def invalidate():
+        SettingsCache._snapshot = None
+
+    @staticmethod
+    def _before_flush(session, flush_context, instances):
+        changed = False
+        for obj in session.new:
+            if isinstance(obj, SystemSettings):
+                changed = True
+        for obj in session.dirty:
+            if isinstance(obj, SystemSettings) and session.is_modified(obj):
+                obj.version = SystemSettings.version + 1
+                changed = True
+        if changed:
+            session.info['settings_changed'] = True
+
+    @staticmethod
+    def _after_commit(session):
+        if session.info.pop('settings_changed', False):
+            SettingsCache.invalidate()
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('settings_changed', None)
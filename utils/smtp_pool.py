@@ -0,0 +1,120 @@
+import queue
+import smtplib
+import threading
+import time
+from flask import current_app
+
+
+class SMTPSession:
+    """One authenticated SMTP connection plus its usage counters."""
+
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+        self.sent_count = 0
+        self.last_used = 0
+
+    def connect(self):
+        config = self.config
+        if config.get('port') == 465:
+            current_app.logger.info(f"Connecting to {config['host']}:465 with SSL")
+            server = smtplib.SMTP_SSL(config['host'], 465, timeout=30)
+        else:
+            current_app.logger.info(f"Connecting to {config['host']}:{config['port']} with STARTTLS")
+            server = smtplib.SMTP(config['host'], config['port'], timeout=30)
+            server.ehlo()
+            if config.get('use_tls', True):
+                server.starttls()
+                server.ehlo()
+
+        current_app.logger.info(f"Logging in as {config['user']}")
+        server.login(config['user'], config['password'])
+
+        self.server = server
+        self.sent_count = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+
+    def send(self, msg):
+        self.server.send_message(msg)
+        self.sent_count += 1
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Pool of authenticated SMTP sessions reused across messages.
+
+    At most `size` sessions exist at once. A session is retired after
+    `max_messages` sends (relays cap messages per connection) or when it has
+    been idle longer than `idle_timeout` seconds. A send that fails because the
+    server dropped the connection is retried once on a fresh session.
+    """
+
+    # 421 = service closing channel, typically "too many messages" or idle timeout
+    RECONNECT_CODES = (421,)
+
+    def __init__(self, config, size=4, max_messages=100, idle_timeout=60):
+        self.config = config
+        self.size = size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _checkout(self):
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            session = SMTPSession(self.config)
+
+        if session.server and time.monotonic() - session.last_used > self.idle_timeout:
+            session.close()
+        if not session.server:
+            session.connect()
+        return session
+
+    def _checkin(self, session):
+        if session.server and session.sent_count < self.max_messages:
+            self._idle.put(session)
+        else:
+            session.close()
+
+    def send_message(self, msg):
+        """Send one message over a pooled session, reconnecting if needed"""
+        self._slots.acquire()
+        session = None
+        try:
+            session = self._checkout()
+            try:
+                session.send(msg)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError) as e:
+                code = getattr(e, 'smtp_code', None)
+                if isinstance(e, smtplib.SMTPResponseException) and code not in self.RECONNECT_CODES:
+                    raise
+                current_app.logger.info(f"SMTP session dropped ({e}), reconnecting")
+                session.close()
+                session.connect()
+                session.send(msg)
+        except Exception:
+            if session:
+                session.close()
+            raise
+        finally:
+            if session:
+                self._checkin(session)
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,91 @@
+import threading
+from collections import namedtuple
+from flask_socketio import rooms
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .chat_writer import AssignmentRef, chat_room
+from .participant_context import ParticipantLoader
+
+
+ChatBinding = namedtuple('ChatBinding', 'user_id role assignment reveal_completed')
+
+
+class ChatSessionCache:
+    """
+    Verified socket -> (user, assignment, role) bindings, so chat events after
+    join_chat need no lookups.
+
+    A binding is only trusted while the socket is still in the chat room.
+    When a transaction that changes an assignment's participants commits
+    (mark_stale), the room is closed on every worker through the Socket.IO
+    message queue and its clients are told to rejoin, which re-runs the
+    database checks.
+    """
+
+    _bindings = {}
+    _lock = threading.Lock()
+    _socketio = None
+
+    @staticmethod
+    def init_app(socketio):
+        ChatSessionCache._socketio = socketio
+        event.listen(Session, 'after_commit', ChatSessionCache._after_commit)
+        event.listen(Session, 'after_rollback', ChatSessionCache._after_rollback)
+
+    @staticmethod
+    def bind(sid, user_id, assignment, role):
+        binding = ChatBinding(
+            user_id=user_id,
+            role=role,
+            assignment=AssignmentRef(assignment.id, assignment.gifter_user_id, assignment.giftee_user_id),
+            reveal_completed=bool(assignment.reveal_completed)
+        )
+        with ChatSessionCache._lock:
+            ChatSessionCache._bindings[sid] = binding
+        return binding
+
+    @staticmethod
+    def get(sid, user_id, assignment_id):
+        """The binding for this socket if it still covers `assignment_id`"""
+        binding = ChatSessionCache._bindings.get(sid)
+        if binding is None:
+            return None
+        if binding.user_id != user_id or binding.assignment.id != assignment_id \
+                or chat_room(assignment_id) not in rooms(sid=sid):
+            ChatSessionCache.drop(sid)
+            return None
+        return binding
+
+    @staticmethod
+    def drop(sid):
+        with ChatSessionCache._lock:
+            ChatSessionCache._bindings.pop(sid, None)
+
+    @staticmethod
+    def mark_stale(session, assignment_ids):
+        """Close these chats' rooms once the current transaction commits"""
+        session.info.setdefault('stale_chat_rooms', set()).update(assignment_ids)
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('stale_chat_rooms', None)
+
+    @staticmethod
+    def _after_commit(session):
+        assignment_ids = session.info.pop('stale_chat_rooms', None)
+        if not assignment_ids:
+            return
+        # Cached participant contexts may point at the old pairs too
+        ParticipantLoader.invalidate()
+        if ChatSessionCache._socketio is None:
+            return
+
+        with ChatSessionCache._lock:
+            for sid, binding in list(ChatSessionCache._bindings.items()):
+                if binding.assignment.id in assignment_ids:
+                    del ChatSessionCache._bindings[sid]
+
+        for assignment_id in assignment_ids:
+            room = chat_room(assignment_id)
+            ChatSessionCache._socketio.emit('rejoin_required', {'assignment_id': assignment_id}, room=room)
+            ChatSessionCache._socketio.close_room(room)
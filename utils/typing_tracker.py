@@ -0,0 +1,112 @@
+import threading
+import time
+
+
+class TypingTracker:
+    """
+    Coalesces typing indicators per socket.
+
+    Clients may report typing as often as they like; only changes of the
+    broadcast state (started/stopped) reach the room. A socket can start
+    typing at most once per TYPING_MIN_INTERVAL, and a socket that stops
+    sending updates is marked as stopped after TYPING_TTL seconds.
+    """
+
+    _state = {}  # sid -> {'room', 'typing', 'expires_at', 'last_broadcast', 'pending'}
+    _lock = threading.Lock()
+    _app = None
+    _socketio = None
+    _ttl = 5.0
+    _min_interval = 0.5
+
+    @staticmethod
+    def start(app, socketio):
+        with TypingTracker._lock:
+            if TypingTracker._socketio is not None:
+                return
+            TypingTracker._app = app
+            TypingTracker._socketio = socketio
+            TypingTracker._ttl = app.config.get('TYPING_TTL', 5.0)
+            TypingTracker._min_interval = app.config.get('TYPING_MIN_INTERVAL', 0.5)
+
+        threading.Thread(target=TypingTracker._sweep_loop, name='typing-expiry', daemon=True).start()
+
+    @staticmethod
+    def update(sid, room, typing):
+        now = time.monotonic()
+        broadcast = None
+        left_room = None
+        with TypingTracker._lock:
+            entry = TypingTracker._state.get(sid)
+            if entry is None or entry['room'] != room:
+                if entry is not None and entry['typing']:
+                    left_room = entry['room']
+                entry = {'room': room, 'typing': False, 'expires_at': 0, 'last_broadcast': 0, 'pending': False}
+                TypingTracker._state[sid] = entry
+
+            if typing:
+                entry['expires_at'] = now + TypingTracker._ttl
+                if not entry['typing']:
+                    if now - entry['last_broadcast'] >= TypingTracker._min_interval:
+                        entry['typing'] = True
+                        entry['pending'] = False
+                        entry['last_broadcast'] = now
+                        broadcast = True
+                    else:
+                        # Too soon after the last change; the sweeper sends it
+                        entry['pending'] = True
+            else:
+                entry['pending'] = False
+                if entry['typing']:
+                    entry['typing'] = False
+                    entry['last_broadcast'] = now
+                    broadcast = False
+
+        if left_room is not None:
+            TypingTracker._emit(left_room, False, sid)
+        if broadcast is not None:
+            TypingTracker._emit(room, broadcast, sid)
+
+    @staticmethod
+    def stop(sid):
+        """Socket sent a message or went away"""
+        with TypingTracker._lock:
+            entry = TypingTracker._state.pop(sid, None)
+        if entry and entry['typing']:
+            TypingTracker._emit(entry['room'], False, sid)
+
+    @staticmethod
+    def _sweep():
+        now = time.monotonic()
+        changes = []
+        with TypingTracker._lock:
+            for sid, entry in list(TypingTracker._state.items()):
+                if entry['typing'] and entry['expires_at'] <= now:
+                    entry['typing'] = False
+                    entry['last_broadcast'] = now
+                    changes.append((entry['room'], False, sid))
+                elif entry['pending'] and entry['expires_at'] > now \
+                        and now - entry['last_broadcast'] >= TypingTracker._min_interval:
+                    entry['typing'] = True
+                    entry['pending'] = False
+                    entry['last_broadcast'] = now
+                    changes.append((entry['room'], True, sid))
+                elif not entry['typing'] and entry['expires_at'] <= now:
+                    del TypingTracker._state[sid]
+
+        for room, typing, sid in changes:
+            TypingTracker._emit(room, typing, sid)
+
+    @staticmethod
+    def _sweep_loop():
+        while True:
+            time.sleep(min(TypingTracker._min_interval, 1.0))
+            try:
+                TypingTracker._sweep()
+            except Exception:
+                TypingTracker._app.logger.exception('Typing indicator sweep failed')
+
+    @staticmethod
+    def _emit(room, typing, sid):
+        if TypingTracker._socketio is not None:
+            TypingTracker._socketio.emit('user_typing', {'typing': typing}, room=room, skip_sid=sid)